@@ -0,0 +1,101 @@
+"""A feed of recent activity on the site for the live board.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+Events are kept in memcache only, in a ring buffer of settings.ACTIVITY_SIZE
+slots. Each event is given the next number of a sequence counter and stored
+in slot number % size, so recording one is a counter increment and a single
+set. Pollers pass the last sequence number they have seen and get back only
+newer events; when nothing has happened that costs a single memcache get and
+no datastore work at all.
+
+An event's sequence number is taken before the event is stored in its slot,
+so a poll can see the number of an event that isn't there yet. since() stops
+short of such a gap and the poller asks for it again next time. Memcache may
+also evict events, or a request may die between the two steps; once a later
+event is more than RECORD_GRACE seconds old the gap is skipped, and pollers
+never see the missing event. The live board is a best effort view and
+nothing else reads the feed.
+"""
+import time
+
+from google.appengine.api import memcache
+
+import settings
+
+SEQUENCE_KEY = 'activity:sequence'
+# seconds an event may take to appear in its slot after its number is taken
+RECORD_GRACE = 10
+
+
+def _slot_key(sequence):
+    """Returns the memcache key of the slot an event is stored in."""
+    return 'activity:slot:%d' % (sequence % settings.ACTIVITY_SIZE)
+
+
+def record(kind, text, url=None):
+    """Adds an event to the feed.
+
+    Arguments:
+    kind: what happened, e.g. 'idea' or 'vote'
+    text: a description of the event to show on the live board
+    url: a page on the site the event links to
+    """
+    # a lost counter restarts from the clock so sequence numbers never go
+    # backwards and pollers ahead of the new counter don't stall
+    sequence = memcache.incr(SEQUENCE_KEY,
+                             initial_value=int(time.time() * 1000))
+    if sequence is None:
+        return None
+    event = {'sequence': sequence,
+             'kind': kind,
+             'text': text,
+             'url': url,
+             'time': int(time.time())}
+    memcache.set(_slot_key(sequence), event)
+    return event
+
+
+def latest():
+    """Returns the sequence number of the newest event, or 0."""
+    return memcache.get(SEQUENCE_KEY) or 0
+
+
+def since(after, newest=None):
+    """Returns the events after a sequence number, oldest first.
+
+    Arguments:
+    after: the sequence number of the last event the caller has seen. events
+           that have been overwritten in the ring buffer are skipped.
+    newest: the current value of latest(), if the caller already has it.
+
+    Returns: a tuple of the list of events and the sequence number to pass as
+             after next time. It is before the first event that may still be
+             being recorded, so that event is fetched by the next call.
+    """
+    if newest is None:
+        newest = latest()
+    if newest <= after:
+        return ([], after)
+    first = max(after + 1, newest - settings.ACTIVITY_SIZE + 1)
+    sequences = range(first, newest + 1)
+    slots = memcache.get_multi([_slot_key(sequence) for sequence in sequences])
+    # a slot may hold an older event that was never overwritten
+    found = {}
+    for event in slots.values():
+        if first <= event['sequence'] <= newest:
+            found[event['sequence']] = event
+    # gaps before an event recorded longer ago than the grace period will
+    # never be filled
+    settled = max([sequence for sequence, event in found.items()
+                   if event['time'] < time.time() - RECORD_GRACE] or [0])
+
+    events = []
+    through = first - 1
+    for sequence in sequences:
+        if sequence in found:
+            events.append(found[sequence])
+        elif sequence > settled:
+            break
+        through = sequence
+    return (events, through)
@@ -0,0 +1,192 @@
+"""Handlers for administrators, background tasks and instance warmup.
+
+Author: Dan Albert <dan@gingerhq.net>
+"""
+import json
+import logging
+import time
+
+import webapp2
+from google.appengine.ext import db
+
+import auth
+import base
+import cache
+import export
+import groups
+import leaderboard
+import search
+import settings
+import stats
+import votes
+from base import RequestHandler
+from messages import Messages
+from models import Project
+
+
+class AdminHandler(RequestHandler):
+    """Handler for site maintenance tasks."""
+    def reindex(self):
+        """Rebuilds derived indexes and migrates data from older versions."""
+        if not auth.user_is_admin():
+            return self.abort(403)
+        groups.rebuild_memberships()
+        groups.rebuild_names()
+        votes.flush()
+        votes.migrate_legacy()
+        votes.recount()
+        leaderboard.rebuild()
+        search.rebuild()
+        cache.bump('project')
+        Messages.add('The indexes have been rebuilt')
+        return self.redirect('/groups')
+
+    def export_data(self):
+        """Exports ideas, projects, groups and submissions for download.
+
+        The rows are produced by a generator set as the response body, so
+        they are read a batch at a time as the server sends them rather than
+        collected in the response first. App Engine itself holds the whole
+        response until it ends and limits it to 32MB, so large exports there
+        should be made with tools/export_data.py.
+
+        Query Parameters:
+            kinds:  comma separated kinds to export. defaults to all of them
+            since:  ISO 8601 timestamp. if given, only entities posted after
+                    it are exported
+            format: either jsonl (the default) or csv
+        """
+        if not auth.user_is_admin():
+            return self.abort(403)
+
+        kinds = [kind for kind in self.request.get('kinds').split(',') if kind]
+        if any(kind not in export.MODELS for kind in kinds):
+            return self.abort(400, 'kinds must be among %s' %
+                              ', '.join(export.KINDS))
+        since = None
+        if self.request.get('since'):
+            try:
+                since = export.parse_since(self.request.get('since'))
+            except ValueError as e:
+                return self.abort(400, str(e))
+        fmt = self.request.get('format', 'jsonl')
+        if fmt not in export.FORMATS:
+            return self.abort(400, 'format must be jsonl or csv')
+
+        (writer, content_type) = export.FORMATS[fmt]
+        self.response.headers['Content-Type'] = content_type
+        self.response.headers['Content-Disposition'] = \
+            'attachment; filename=export.%s' % fmt
+        self.response.app_iter = writer(export.rows(kinds or None, since))
+
+    def stats(self):
+        """Displays the latest event statistics."""
+        if not auth.user_is_admin():
+            return self.abort(403)
+        (snapshot, job) = stats.current()
+        data = {'snapshot': snapshot, 'job': job}
+        if snapshot is not None:
+            data['stats'] = json.loads(snapshot.stats)
+            groups_stats = data['stats']['groups']
+            data['sizes'] = sorted((int(size), count) for size, count in
+                                   groups_stats['sizes'].items())
+            buckets = data['stats']['projects']['vote_buckets']
+            data['buckets'] = [(label, buckets.get(label, 0))
+                               for _, label in stats.VOTE_BUCKETS]
+        return self.render('admin_stats', data)
+
+    def stats_status(self):
+        """Returns the age of the statistics and the job's progress as JSON.
+
+        The dashboard polls this while a job is running and reloads when new
+        statistics are ready.
+        """
+        if not auth.user_is_admin():
+            return self.abort(403)
+        (snapshot, job) = stats.current()
+        status = {
+            'updated': snapshot.updated.isoformat() if snapshot else None,
+            'running': job is not None,
+            'kind': job.kind if job else None,
+            'step': job.step if job else None,
+        }
+        self.response.headers['Cache-Control'] = 'no-cache'
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json.dumps(status))
+
+    def refresh_stats(self):
+        """Starts computing new event statistics."""
+        if not auth.user_is_admin():
+            return self.abort(403)
+        if stats.start():
+            Messages.add('The statistics are being refreshed')
+        else:
+            Messages.add('The statistics are already being refreshed')
+        return self.redirect('/admin/stats')
+
+
+class TaskHandler(webapp2.RequestHandler):
+    """Handler for background tasks run by the task queue and cron."""
+    def flush_votes(self):
+        """Applies queued votes to the vote ledger and the standings.
+
+        Form Variables:
+            project: keys of projects voted on without the queue, whose
+                     standings also need updating
+        """
+        changed = set(votes.flush())
+        changed.update(db.Key(key) for key in self.request.get_all('project'))
+        if leaderboard.refresh(changed):
+            cache.bump('project')
+
+    def add_projects(self):
+        """Adds newly approved projects to the standings."""
+        projects = [project for project
+                    in Project.get(self.request.get_all('project'))
+                    if project is not None]
+        leaderboard.add_projects(projects)
+
+    def sync_memberships(self):
+        """Updates the membership entries of users whose group changed."""
+        user_ids = [user_id for user_id
+                    in self.request.get('users').split(',') if user_id]
+        groups.sync_memberships(self.request.get('group'), user_ids)
+
+    def start_stats(self):
+        """Starts computing new event statistics, run by cron."""
+        stats.start()
+
+    def stats_step(self):
+        """Processes the next chunk of the statistics job."""
+        try:
+            step = int(self.request.get('step'))
+        except ValueError:
+            return self.abort(400)
+        stats.step(step)
+
+
+class WarmupHandler(webapp2.RequestHandler):
+    """Handler for the warmup requests App Engine sends to new instances."""
+    def warmup(self):
+        """Prepares a new instance before it serves its first visitor.
+
+        The handler modules that are loaded lazily are imported, every template
+        is compiled, and the pages listed in settings.WARMUP_PAGES are
+        requested so their rendered listings are in the instance's cache.
+        """
+        start = time.time()
+        for route in self.app.router.match_routes:
+            if isinstance(route.handler, basestring):
+                webapp2.import_string(route.handler)
+        imported = time.time()
+        compiled = base.precompile_templates()
+        templates = time.time()
+        # requested last, since a nested request clears this one's globals
+        for path in settings.WARMUP_PAGES:
+            self.app.get_response(path)
+        logging.info('Warmed up in %.0f ms: imported handlers in %.0f ms, '
+                     'compiled %d templates in %.0f ms, requested %d pages '
+                     'in %.0f ms', (time.time() - start) * 1000,
+                     (imported - start) * 1000, compiled,
+                     (templates - imported) * 1000, len(settings.WARMUP_PAGES),
+                     (time.time() - templates) * 1000)
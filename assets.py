@@ -0,0 +1,55 @@
+"""Lookup of generated static assets.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+The build scripts in tools/ write the files they generate to static/build/,
+along with a JSON manifest describing them. Manifests are read once per
+instance. If a build script hasn't been run, its manifest is treated as
+empty and the original files are used instead.
+"""
+import json
+import os
+
+import settings
+
+_manifests = {}
+
+
+def manifest(name):
+    """Returns the contents of the manifest static/build/<name>.json."""
+    if name not in _manifests:
+        path = os.path.join(settings.BASE_DIR, settings.STATIC_DIR, 'build',
+                            '%s.json' % name)
+        try:
+            with open(path) as f:
+                _manifests[name] = json.load(f)
+        except IOError:
+            _manifests[name] = {}
+    return _manifests[name]
+
+
+def url(name):
+    """Returns the URL to serve a file in static/ from.
+
+    This is the fingerprinted copy made by tools/build_assets.py if there is
+    one, so it may be cached indefinitely, or the original file otherwise.
+    """
+    return manifest('assets').get(name, '/static/%s' % name)
+
+
+def critical_css(name):
+    """Returns the rules of a stylesheet needed for the first paint.
+
+    These are extracted by tools/build_assets.py. If it hasn't been run, this
+    is empty and pages are unstyled until the stylesheet loads.
+    """
+    return manifest('critical').get(name, '')
+
+
+def image(name):
+    """Returns the manifest entry of the derivatives of an image, or None.
+
+    Arguments:
+    name: the file name of the original image in static/.
+    """
+    return manifest('images').get(name)
@@ -4,20 +4,74 @@ Author: Dan Albert <dan@gingerhq.net>
 
 Wrappers are used for authorization and authentication code in case we need to
 introduce a different mechanism in the future.
+
+Identity lookups are cached for the lifetime of the current request, so
+templates may freely refer to user.group and friends inside loops.
 """
+import functools
+
+import webapp2
+
 from google.appengine.api import users
+from google.appengine.ext import db
+
+from models import Membership
 
-from models import Group
+
+def _request_cache():
+    """Returns a dict that lives as long as the current request, or None.
+
+    None is returned when there is no active request, such as when this module
+    is used from a script.
+    """
+    try:
+        request = webapp2.get_request()
+    except (AssertionError, AttributeError):
+        return None
+    return request.registry.setdefault('auth', {})
+
+
+def _cached(name, func):
+    """Returns func(), computing it at most once per request."""
+    cache = _request_cache()
+    if cache is None:
+        return func()
+    if name not in cache:
+        cache[name] = func()
+    return cache[name]
 
 
 def current_user():
     """Returns the User object for the signed in user or None."""
-    return users.get_current_user()
+    return _cached('current_user', users.get_current_user)
 
 
 def user_is_admin():
     """Returns True if the current user is an administrator."""
-    return users.is_current_user_admin()
+    return _cached('user_is_admin', users.is_current_user_admin)
+
+
+def get_user():
+    """Returns the User wrapper for the signed in user or None.
+
+    The same wrapper is returned for the whole request, so everything it looks
+    up is only fetched once.
+    """
+    def wrap():
+        user = current_user()
+        return User(user) if user is not None else None
+    return _cached('user', wrap)
+
+
+def invalidate_user():
+    """Discards cached group information for the signed in user.
+
+    This must be called whenever the group membership of the current user may
+    have changed during the request.
+    """
+    cache = _request_cache()
+    if cache is not None and cache.get('user') is not None:
+        cache['user'].invalidate()
 
 
 def logged_in():
@@ -48,6 +102,16 @@ def user_from_email(email):
     return users.User(email=email)
 
 
+def _memoized(func):
+    """Caches the result of a User method until User.invalidate is called."""
+    @functools.wraps(func)
+    def wrapper(self):
+        if func.__name__ not in self._cache:
+            self._cache[func.__name__] = func(self)
+        return self._cache[func.__name__]
+    return wrapper
+
+
 class User(object):
     """A wrapper for the GAE User class.
 
@@ -58,6 +122,7 @@ class User(object):
     """
     def __init__(self, user):
         self.gae_user = user
+        self._cache = {}
 
     def __eq__(self, other):
         if type(other) is users.User:
@@ -72,26 +137,42 @@ class User(object):
         """Returns the user ID for the user."""
         return self.gae_user.user_id()
 
+    def invalidate(self):
+        """Discards everything cached about the user's group."""
+        self._cache.clear()
+
+    def prime(self, **values):
+        """Caches values fetched elsewhere, keyed by property name."""
+        self._cache.update(values)
+
     @property
+    @_memoized
+    def membership(self):
+        """The user's entry in the membership index, or None."""
+        return Membership.get_by_key_name(self.user_id)
+
+    @property
+    @_memoized
     def group(self):
         """The group the user belongs to, or None."""
-        for group in Group.all():
-            if self.gae_user in group.members:
-                return group
-        return None
+        membership = self.membership
+        if membership is None or membership.status != Membership.MEMBER:
+            return None
+        return db.get(membership.group_key)
 
+    @_memoized
     def in_group(self):
         """Returns True if the user is in a group, else returns False."""
         return self.group is not None
 
+    @_memoized
     def pending_join(self):
         """Returns True if the user is pending approval to join a group."""
-        for group in Group.all():
-            for user in group.pending_users:
-                if user.user_id() == self.user_id:
-                    return True
-        return False
+        membership = self.membership
+        return (membership is not None and
+                membership.status == Membership.PENDING)
 
+    @_memoized
     def owns_a_group(self):
         """Returns True if the user owns his/her group, else returns False."""
         try:
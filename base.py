@@ -0,0 +1,211 @@
+"""Template rendering and the request handler the site's pages share.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+Kept apart from main.py so handler modules that are only imported when one
+of their routes is first requested can use them without loading main.
+
+Pages that look the same to everyone with the same login state can be cached
+whole with RequestHandler.render_page. The cache is keyed by a fingerprint of
+the templates and asset manifests, so a deploy that changes them never serves
+pages cached by the previous version.
+"""
+import cStringIO
+import glob
+import gzip
+import hashlib
+import os
+
+import webapp2
+
+import auth
+import cache
+import devices
+import instrumentation
+import settings
+from messages import Messages
+from google.appengine.ext.webapp import template
+
+template.register_template_library('tags')
+
+
+def template_path(template_name):
+    """Returns the path of a template in the template directory."""
+    return os.path.join(settings.BASE_DIR, settings.TEMPLATE_DIR,
+                        "%s.html" % template_name)
+
+
+def render_template(template_name, data):
+    """Renders a template from the template directory to a string.
+
+    Arguments:
+    template_name: the name of the template, relative to the template
+                   directory and without the .html extension.
+
+    data: a dictionary containing data to be passed to the template.
+    """
+    with instrumentation.timed('render'):
+        return template.render(template_path(template_name), data)
+
+
+_version = None
+
+
+def template_version():
+    """Returns a fingerprint of the templates and asset manifests.
+
+    Files can't change on a deployed instance, so it is only worked out once
+    there. On the development server it is worked out on every call, so
+    edited templates show up right away.
+    """
+    global _version
+    dev = os.environ.get('SERVER_SOFTWARE', '').startswith('Development')
+    if _version is None or dev:
+        digest = hashlib.md5()
+        root = os.path.join(settings.BASE_DIR, settings.TEMPLATE_DIR)
+        paths = glob.glob(os.path.join(settings.BASE_DIR, settings.STATIC_DIR,
+                                       'build', '*.json'))
+        for directory, _, files in os.walk(root):
+            paths.extend(os.path.join(directory, name) for name in files)
+        for path in sorted(paths):
+            with open(path, 'rb') as f:
+                digest.update(path)
+                digest.update(f.read())
+        _version = digest.hexdigest()[:12]
+    return _version
+
+
+def _gzip(body):
+    """Compresses a string with gzip."""
+    out = cStringIO.StringIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', mtime=0) as f:
+        f.write(body)
+    return out.getvalue()
+
+
+def precompile_templates():
+    """Compiles every template so the first request for each is fast.
+
+    Compiled templates are kept by the template module for the life of the
+    instance, and render_template uses them from then on.
+
+    Returns: the number of templates compiled.
+    """
+    root = os.path.join(settings.BASE_DIR, settings.TEMPLATE_DIR)
+    count = 0
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if name.endswith('.html'):
+                template.load(os.path.join(directory, name))
+                count += 1
+    return count
+
+
+class RequestHandler(webapp2.RequestHandler):
+    """Base request handler that handles site wide handling tasks."""
+    def dispatch(self):
+        """Dispatches the request, timing the handler.
+
+        Messages added while handling the request are saved to the visitor's
+        session cookie afterwards.
+        """
+        with instrumentation.timed('handler'):
+            try:
+                return super(RequestHandler, self).dispatch()
+            finally:
+                Messages.save(self.response)
+
+    def device(self):
+        """Returns the class of device the request came from."""
+        return devices.classify(self.request.headers.get('User-Agent', ''))
+
+    def render(self, template_name, data=None):
+        """Renders the template in the site wide manner.
+
+        Retrieves the template data needed for the base template (login URL and
+        text, user information, etc.) and merges it with the data passed to the
+        method. Templates are retrieved from the template directory specified
+        in the settings and appended with the suffix ".html"
+
+        Arguments:
+        template_name: the name of the template. this is the file name of the
+                       template without the .html extension.
+
+        data: a dictionary containing data to be passed to the template.
+        """
+        return self.response.out.write(self.render_string(template_name,
+                                                          data))
+
+    def render_string(self, template_name, data=None):
+        """Renders the template in the site wide manner to a string."""
+        data = dict(data or {})
+        (login_text, login_url) = auth.login_logout(self.request)
+
+        if auth.logged_in():
+            data['user'] = auth.get_user()
+
+        data['admin'] = auth.user_is_admin()
+        data['login_url'] = login_url
+        data['login_text'] = login_text
+        data['messages'] = Messages.get()
+        data['mobile'] = self.device() == devices.MOBILE
+        data['stylesheet'] = 'mobile.css' if data['mobile'] else 'main.css'
+        data['paint_sample_rate'] = settings.PAINT_SAMPLE_RATE
+
+        return render_template(template_name, data)
+
+    def render_page(self, template_name, data=None, variant=''):
+        """Renders a page that only depends on the visitor's login and device.
+
+        The whole page is cached, plain and gzipped, by template, host, path,
+        login state, admin flag, device and the version of the templates.
+        Responses carry a strong ETag, which differs between the plain and
+        gzipped bodies, and requests for a page the browser already has get
+        a 304 Not Modified. A cached page costs no template or datastore work.
+
+        Pages with messages to show, or requested with a query string, are
+        rendered as usual.
+
+        Arguments:
+        template_name: the name of the template, as for render.
+
+        data: a dictionary containing data to be passed to the template, or a
+              function returning one, which is only called if the page has to
+              be rendered.
+
+        variant: a string that changes whenever data would, for pages showing
+                 something other than the templates.
+        """
+        if Messages.pending() or self.request.query_string:
+            return self.render(template_name, data() if callable(data) else
+                               data)
+
+        key = 'fullpage:%s:%s%s:%d:%d:%s:%s:%s' % (
+            template_name, self.request.host, self.request.path,
+            auth.logged_in(), auth.user_is_admin(), self.device(),
+            template_version(), variant)
+        page = cache.get(key)
+        if page is None:
+            body = self.render_string(template_name,
+                                      data() if callable(data) else data)
+            body = body.encode('utf-8')
+            page = (hashlib.md5(body).hexdigest(), body, _gzip(body))
+            cache.put(key, page)
+
+        (etag, body, gzipped) = page
+        compress = 'gzip' in self.request.headers.get('Accept-Encoding', '')
+        if compress:
+            # a strong ETag names one exact body, so the gzipped body needs
+            # a different one
+            etag += '-gz'
+            body = gzipped
+        self.response.headers['Cache-Control'] = 'private, no-cache'
+        self.response.headers['Vary'] = 'Accept-Encoding, Cookie, User-Agent'
+        self.response.etag = etag
+        if etag in self.request.if_none_match:
+            self.response.status = 304
+            return
+        if compress:
+            # App Engine passes bodies the app has compressed through as-is
+            self.response.headers['Content-Encoding'] = 'gzip'
+        self.response.out.write(body)
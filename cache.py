@@ -0,0 +1,111 @@
+"""Caching of rendered fragments and other derived data.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+Values are stored in memcache and in a small in-process LRU cache, which also
+keeps things working when memcache is unavailable. Cached data is keyed by a
+generation number per kind of entity; bumping the generation after changing
+an entity makes everything derived from the old data unreachable, so cached
+values never need to be deleted individually.
+"""
+import collections
+import threading
+import time
+
+from google.appengine.api import memcache
+
+import settings
+
+
+class LRUCache(object):
+    """A thread safe, size limited, least recently used cache."""
+    def __init__(self, size):
+        self.size = size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value stored for key, or None."""
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        """Stores a value, evicting the least recently used one if needed."""
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        """Removes every value from the cache."""
+        with self._lock:
+            self._items.clear()
+
+
+_local = LRUCache(settings.LOCAL_CACHE_SIZE)
+
+# generations used by this instance while memcache is unavailable
+_local_generations = collections.defaultdict(int)
+
+
+def get(key):
+    """Returns the value cached under key, or None.
+
+    Only use this for keys whose value never changes, such as keys containing
+    a generation number, since the in-process copy is never refreshed.
+    """
+    value = _local.get(key)
+    if value is None:
+        value = memcache.get(key)
+        if value is not None:
+            _local.set(key, value)
+    return value
+
+
+def put(key, value):
+    """Caches a value under key."""
+    _local.set(key, value)
+    memcache.set(key, value)
+
+
+def generation(kind):
+    """Returns the current generation number for a kind of entity."""
+    key = 'generation:%s' % kind
+    value = memcache.get(key)
+    if value is None:
+        # a lost counter restarts from the clock so an old generation number
+        # is never reused
+        memcache.add(key, int(time.time() * 1000))
+        value = memcache.get(key)
+    if value is None:
+        value = 'local%d' % _local_generations[kind]
+    return value
+
+
+def bump(kind):
+    """Invalidates everything cached for a kind of entity."""
+    _local_generations[kind] += 1
+    if memcache.incr('generation:%s' % kind) is None:
+        memcache.add('generation:%s' % kind, int(time.time() * 1000))
+
+
+def memoize(kind, variant, build):
+    """Returns build(), cached until the generation of kind is bumped.
+
+    Arguments:
+    kind: the kind of entity the value is derived from.
+
+    variant: a string identifying this value among others for the same kind.
+
+    build: a function computing the value. It must not return None.
+    """
+    key = 'memoize:%s:%s:%s' % (kind, generation(kind), variant)
+    value = get(key)
+    if value is None:
+        value = build()
+        put(key, value)
+    return value
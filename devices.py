@@ -0,0 +1,27 @@
+"""Classification of visitors' devices from their User-Agent header.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+Phones get the mobile stylesheet and layout. There are only so many distinct
+User-Agent strings among the visitors, so classifications are memoized.
+"""
+import cache
+import settings
+
+MOBILE = 'mobile'
+DESKTOP = 'desktop'
+
+_classified = cache.LRUCache(settings.DEVICE_CACHE_SIZE)
+
+
+def classify(user_agent):
+    """Returns MOBILE for phones and DESKTOP for everything else."""
+    device = _classified.get(user_agent)
+    if device is None:
+        if ('iPhone' in user_agent or 'iPod' in user_agent or
+                ('Android' in user_agent and 'Mobile' in user_agent)):
+            device = MOBILE
+        else:
+            device = DESKTOP
+        _classified.set(user_agent, device)
+    return device
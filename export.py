@@ -0,0 +1,187 @@
+"""Streaming export of ideas, projects, groups and submissions.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+Entities are read in cursor-sized batches and turned into lines of JSON or
+CSV by generators, so only one batch is held in memory at a time however
+much data there is. References are resolved with one batch get per batch,
+and each project's vote total and claiming groups are included.
+"""
+import csv
+import datetime
+import io
+import json
+
+from google.appengine.api import users
+from google.appengine.ext import db
+
+import leaderboard
+import votes
+from models import Group, Idea, Project, Submission
+
+MODELS = {'Idea': Idea, 'Project': Project, 'Group': Group,
+          'Submission': Submission}
+
+# the fields exported for each kind, in order
+FIELDS = {
+    'Idea': ['key', 'name', 'author', 'description', 'post_time'],
+    'Project': ['key', 'name', 'author', 'description', 'post_time', 'votes',
+                'groups'],
+    'Group': ['key', 'name', 'public', 'owner', 'members', 'pending_users',
+              'project', 'project_name', 'post_time'],
+    'Submission': ['key', 'group', 'group_name', 'text', 'url', 'weight',
+                   'post_time'],
+}
+
+KINDS = ['Idea', 'Project', 'Group', 'Submission']
+
+# columns of the CSV format, which has every kind in one table
+COLUMNS = ['kind'] + sorted(set(field for fields in FIELDS.values()
+                                for field in fields))
+
+DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+
+def parse_since(value):
+    """Parses an ISO 8601 timestamp given as the since parameter.
+
+    Raises: ValueError if the timestamp isn't understood.
+    """
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError('unrecognized timestamp: %s' % value)
+
+
+def batches(model, since=None, size=100):
+    """Yields lists of entities of a model, following the query cursor.
+
+    If since is given, only entities posted after it are returned, oldest
+    first. Groups and submissions saved before they had a post_time have
+    none stored, so incremental exports skip them until they are next saved
+    and stamped with the time of that save. Until then they are exported
+    with the time they were read, which auto_now_add fills in on load.
+    """
+    query = model.all()
+    if since is not None:
+        query.filter('post_time >', since).order('post_time')
+    while True:
+        batch = query.fetch(size)
+        if not batch:
+            return
+        yield batch
+        if len(batch) < size:
+            return
+        query.with_cursor(query.cursor())
+
+
+def _value(value):
+    """Converts a property value into something JSON can represent."""
+    if isinstance(value, users.User):
+        return value.email()
+    elif isinstance(value, datetime.datetime):
+        return value.isoformat()
+    elif isinstance(value, db.Key):
+        return str(value)
+    elif isinstance(value, list):
+        return [_value(item) for item in value]
+    return value
+
+
+def _references(entities, prop):
+    """Returns a dict of the keys referenced by prop to their entities."""
+    keys = list(set(key for key in (prop.get_value_for_datastore(entity)
+                                    for entity in entities)
+                    if key is not None))
+    return dict((key, entity) for key, entity in zip(keys, db.get(keys))
+                if entity is not None)
+
+
+def _rows(kind, batch, claims):
+    """Yields a dict of exported fields for each entity of a batch."""
+    extra = dict((entity.key(), {}) for entity in batch)
+    if kind == 'Project':
+        totals = votes.counts([entity.key() for entity in batch])
+        for key in extra:
+            extra[key]['votes'] = totals[key]
+            extra[key]['groups'] = claims.get(str(key), [])
+    elif kind == 'Group':
+        projects = _references(batch, Group.project)
+        for entity in batch:
+            key = Group.project.get_value_for_datastore(entity)
+            project = projects.get(key)
+            extra[entity.key()]['project_name'] = project and project.name
+    elif kind == 'Submission':
+        groups = _references(batch, Submission.group)
+        for entity in batch:
+            group = groups.get(entity.group_key)
+            extra[entity.key()]['group_name'] = group and group.name
+
+    for entity in batch:
+        row = {'kind': kind, 'key': str(entity.key())}
+        for field in FIELDS[kind]:
+            if field in extra[entity.key()]:
+                row[field] = extra[entity.key()][field]
+            elif field in entity.properties():
+                prop = entity.properties()[field]
+                if isinstance(prop, db.ReferenceProperty):
+                    row[field] = _value(prop.get_value_for_datastore(entity))
+                else:
+                    row[field] = _value(getattr(entity, field))
+        yield row
+
+
+def rows(kinds=None, since=None):
+    """Yields every exported entity as a dict, one kind after another.
+
+    Arguments:
+    kinds: the names of the kinds to export, or None to export all of them.
+    since: a datetime; if given only entities posted after it are exported.
+           May also be a dict of kind names to datetimes, so that each kind
+           is exported from its own point. Kinds missing from it are
+           exported in full.
+    """
+    claims = dict((row['key'], [group['name'] for group in row['groups']])
+                  for row in leaderboard.standings())
+    for kind in kinds or KINDS:
+        start = since.get(kind) if isinstance(since, dict) else since
+        for batch in batches(MODELS[kind], start):
+            for row in _rows(kind, batch, claims):
+                yield row
+
+
+def jsonl(rows):
+    """Yields each row as a line of JSON."""
+    for row in rows:
+        yield json.dumps(row, sort_keys=True) + '\n'
+
+
+def _cell(value):
+    """Formats a value as a UTF-8 encoded CSV cell."""
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        value = u'; '.join(value)
+    if not isinstance(value, basestring):
+        value = unicode(value)
+    return value.encode('utf-8')
+
+
+def csv_lines(rows):
+    """Yields a CSV header line followed by a line for each row."""
+    out = io.BytesIO()
+    writer = csv.writer(out)
+    writer.writerow(COLUMNS)
+    for row in rows:
+        writer.writerow([_cell(row.get(column)) for column in COLUMNS])
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+    if out.getvalue():
+        yield out.getvalue()
+
+
+FORMATS = {'jsonl': (jsonl, 'application/x-ndjson'),
+           'csv': (csv_lines, 'text/csv')}
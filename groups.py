@@ -0,0 +1,445 @@
+"""Operations that change the roster or name of a group.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+Every change to a group's members or pending users must also update the
+Membership index used by auth.User, and every group name is reserved by a
+GroupName entity. Joining, leaving and creating a group write the user's
+index entry in the same transaction as the group, since that is where a user
+is kept to one group. Other changes to the roster queue a task with the
+transaction that updates the affected entries in batches.
+
+The group pages read through details(), which fetches a group and everything
+shown alongside it with concurrent RPCs.
+"""
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+
+import auth
+from models import Group, GroupName, Membership, Submission
+from models import run_in_xg_transaction
+
+SYNC_URL = '/tasks/groups/memberships'
+# membership entries updated per transaction, leaving room for the group
+MEMBERSHIP_BATCH = 24
+
+
+class NameTaken(Exception):
+    """Raised when a group would take a name that another group has."""
+
+
+class AlreadyInGroup(Exception):
+    """Raised when a user who is in or waiting to join a group joins another.
+
+    The status of the user's existing membership is available as status.
+    """
+    def __init__(self, status):
+        Exception.__init__(self, status)
+        self.status = status
+
+
+class NotInGroup(Exception):
+    """Raised when a user leaves a group they are not a member of."""
+
+
+class OwnerRemoved(Exception):
+    """Raised when a change to a group would remove its owner."""
+
+
+def snapshot(group):
+    """Returns the roster of a group as a dict of user ID to (user, status).
+
+    save() compares the snapshots taken before and after a change so only
+    the index entries that actually changed are updated.
+    """
+    roster = {}
+    for user in group.pending_users:
+        roster[user.user_id()] = (user, Membership.PENDING)
+    for user in group.members:
+        roster[user.user_id()] = (user, Membership.MEMBER)
+    # users constructed from an email address have no ID and can't be indexed
+    roster.pop(None, None)
+    return roster
+
+
+def details(key, user=None):
+    """Fetches a group along with its project and submissions.
+
+    The submissions query is started first and runs while the group and the
+    user's membership are fetched in one batch get. The project and the
+    user's own group are then fetched together in a second, so the page waits
+    for two round trips however much it shows. The user's membership and
+    group are stored in their cache so the template's checks don't fetch them
+    again.
+
+    Arguments:
+    key: the key of the group, or its string form
+    user: the auth.User viewing the group, if anyone is logged in
+
+    Returns: a dict of the group, project and submissions for the template,
+             or None if there is no such group.
+    """
+    key = db.Key(key) if isinstance(key, basestring) else key
+    # run() starts the query without waiting for its first batch
+    submissions = Submission.all().filter('group =', key).run()
+    keys = [key]
+    if user is not None:
+        keys.append(Membership.key_for(user.user_id))
+    fetched = db.get(keys)
+    group = fetched[0]
+    if group is None:
+        return None
+
+    membership = fetched[1] if user is not None else None
+    member_of = None
+    if membership is not None and membership.status == Membership.MEMBER:
+        member_of = membership.group_key
+    project_key = Group.project.get_value_for_datastore(group)
+    keys = [k for k in (project_key, member_of) if k not in (None, key)]
+    related = dict(zip(keys, db.get(keys) if keys else []))
+
+    if user is not None:
+        user.prime(membership=membership,
+                   group=group if member_of == key else related.get(member_of))
+    return {'group': group,
+            'project': related.get(project_key),
+            'submissions': list(submissions)}
+
+
+def join(key, user):
+    """Adds a user to a public group, or asks to join a private one.
+
+    The group and the user's membership are read in the transaction that
+    writes them, so a user can't end up in two groups by joining both at once
+    and a concurrent change to the roster isn't lost.
+
+    Arguments:
+    key: the key of the group
+    user: the users.User joining it
+
+    Returns: the group as stored, or None if there is no such group.
+
+    Raises: AlreadyInGroup if the user is in, or waiting to join, any group.
+    """
+    key = db.Key(key) if isinstance(key, basestring) else key
+
+    def txn():
+        (group, membership) = db.get([key, Membership.key_for(user.user_id())])
+        if group is None:
+            return None
+        if membership is not None:
+            raise AlreadyInGroup(membership.status)
+        if group.public:
+            group.members.append(user)
+            status = Membership.MEMBER
+        else:
+            group.pending_users.append(user)
+            status = Membership.PENDING
+        db.put([group, Membership(key_name=user.user_id(),
+                                  user=user,
+                                  group=group,
+                                  status=status)])
+        return group
+
+    group = run_in_xg_transaction(txn)
+    auth.invalidate_user()
+    return group
+
+
+def leave(key, user):
+    """Removes a user from the members of a group.
+
+    Raises: NotInGroup if the user is not a member of the group.
+    """
+    key = db.Key(key) if isinstance(key, basestring) else key
+
+    def txn():
+        (group, membership) = db.get([key, Membership.key_for(user.user_id())])
+        if group is None or user not in group.members:
+            raise NotInGroup()
+        group.members = [member for member in group.members
+                         if member != user]
+        db.put(group)
+        if membership is not None and membership.group_key == group.key():
+            db.delete(membership)
+
+    run_in_xg_transaction(txn)
+    auth.invalidate_user()
+
+
+def create(name, public, owner):
+    """Creates a group with its owner as its only member.
+
+    Returns: the new group.
+
+    Raises: NameTaken if another group has the name, or AlreadyInGroup if the
+            owner is in, or waiting to join, another group.
+    """
+    def txn():
+        keys = [GroupName.key_for(name), Membership.key_for(owner.user_id())]
+        (reservation, membership) = db.get(keys)
+        if reservation is not None:
+            raise NameTaken(name)
+        if membership is not None:
+            raise AlreadyInGroup(membership.status)
+        group = Group(name=name, public=public, owner=owner, members=[owner])
+        # the group needs a key before anything can refer to it
+        group.put()
+        db.put([GroupName(key=GroupName.key_for(name), group=group),
+                Membership(key_name=owner.user_id(),
+                           user=owner,
+                           group=group,
+                           status=Membership.MEMBER)])
+        return group
+
+    group = run_in_xg_transaction(txn)
+    auth.invalidate_user()
+    return group
+
+
+def save(key, change, puts=(), deletes=()):
+    """Applies a change to a group and stores it.
+
+    The group is read again in the transaction and passed to change, so
+    anything written since the caller last read it, such as someone joining,
+    is kept. change may be called more than once if the transaction is
+    retried, so it should only modify the group it is given. It may raise an
+    exception to abandon the change.
+
+    A renamed group reserves its new name in the same transaction. The
+    membership entries of users whose status changed are updated afterwards
+    by a task queued with the transaction, see sync_memberships(), so the
+    transaction touches the same few entity groups however many users are
+    approved or removed at once.
+
+    Arguments:
+    key: the key of the group, or its string form.
+
+    change: a function that modifies the group it is given.
+
+    puts: other entities to store in the same transaction, such as new
+          submissions.
+
+    deletes: keys of other entities to delete in the same transaction.
+
+    Returns: the group as stored, or None if there is no such group.
+
+    Raises: NameTaken if the group's new name is in use by another group.
+    """
+    key = db.Key(key) if isinstance(key, basestring) else key
+
+    def txn():
+        group = db.get(key)
+        if group is None:
+            return None
+        before = snapshot(group)
+        previous_name = group.name
+        change(group)
+        after = snapshot(group)
+
+        to_put = [group] + list(puts)
+        to_delete = list(deletes)
+        if GroupName.normalize(previous_name) != \
+                GroupName.normalize(group.name):
+            (reservation, previous) = db.get([
+                GroupName.key_for(group.name),
+                GroupName.key_for(previous_name)])
+            if reservation is not None and reservation.group_key != key:
+                raise NameTaken(group.name)
+            to_put.append(GroupName(key=GroupName.key_for(group.name),
+                                    group=group))
+            if previous is not None and previous.group_key == key:
+                to_delete.append(previous.key())
+        db.put(to_put)
+        db.delete(to_delete)
+
+        changed = [user_id for user_id in set(before) | set(after)
+                   if before.get(user_id, (None, None))[1] !=
+                   after.get(user_id, (None, None))[1]]
+        if changed:
+            _queue_sync(key, changed)
+        return group
+
+    group = run_in_xg_transaction(txn)
+    auth.invalidate_user()
+    return group
+
+
+def delete(key):
+    """Deletes a group and its name reservation.
+
+    The membership entries of everyone on the group are removed by a task
+    queued with the transaction.
+    """
+    key = db.Key(key) if isinstance(key, basestring) else key
+
+    def txn():
+        group = db.get(key)
+        if group is None:
+            return
+        reservation = db.get(GroupName.key_for(group.name))
+        keys = [key]
+        if reservation is not None and reservation.group_key == key:
+            keys.append(reservation.key())
+        db.delete(keys)
+        user_ids = list(snapshot(group))
+        if user_ids:
+            _queue_sync(key, user_ids)
+
+    run_in_xg_transaction(txn)
+    auth.invalidate_user()
+
+
+def _queue_sync(key, user_ids):
+    """Queues sync_memberships() for the given users of a group.
+
+    This must be called in a transaction, so the task only runs if the change
+    to the group is committed.
+    """
+    taskqueue.add(url=SYNC_URL,
+                  params={'group': str(key), 'users': ','.join(user_ids)},
+                  transactional=True)
+
+
+def sync_memberships(key, user_ids):
+    """Brings the membership entries of some users in line with a group.
+
+    The entries are updated MEMBERSHIP_BATCH at a time, each batch in its own
+    transaction with a fresh read of the group, so an entry is never written
+    from an out of date roster and no transaction spans more than 25 entity
+    groups. Entries that point at another group are left alone, and running
+    this again for the same users changes nothing.
+
+    Arguments:
+    key: the key of the group, or its string form. The group may have been
+         deleted.
+    user_ids: the IDs of the users whose entries may be out of date.
+    """
+    key = db.Key(key) if isinstance(key, basestring) else key
+    for i in xrange(0, len(user_ids), MEMBERSHIP_BATCH):
+        run_in_xg_transaction(_sync_batch, key,
+                              user_ids[i:i + MEMBERSHIP_BATCH])
+
+
+def _sync_batch(key, user_ids):
+    """Updates the membership entries of a batch of users of a group."""
+    fetched = db.get([key] + [Membership.key_for(user_id)
+                              for user_id in user_ids])
+    roster = snapshot(fetched[0]) if fetched[0] is not None else {}
+    to_put = []
+    to_delete = []
+    for user_id, membership in zip(user_ids, fetched[1:]):
+        if membership is not None and membership.group_key != key:
+            continue
+        if user_id in roster:
+            (user, status) = roster[user_id]
+            if membership is None or membership.status != status:
+                to_put.append(Membership(key_name=user_id,
+                                         user=user,
+                                         group=key,
+                                         status=status))
+        elif membership is not None:
+            to_delete.append(membership.key())
+    db.put(to_put)
+    db.delete(to_delete)
+
+
+def _batches(query, size=500):
+    """Yields the results of a query in lists of at most size entities."""
+    batch = []
+    for entity in query.run(batch_size=size):
+        batch.append(entity)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def rebuild_memberships():
+    """Repairs the membership index from the rosters of every group.
+
+    Entries that aren't on the roster of the group they point at are deleted
+    first, then the entries of every group are brought up to date with
+    sync_memberships(). Each entry is checked against its group again in the
+    transaction that changes it, and nothing that is right is removed, so
+    users can keep joining and leaving while this runs and running it again
+    after an interruption is safe.
+
+    This is only needed for groups created before the index existed, or to
+    repair the index if it has been modified by hand.
+    """
+    for memberships in _batches(Membership.all()):
+        group_keys = list(set(m.group_key for m in memberships))
+        rosters = dict((key, snapshot(group) if group is not None else {})
+                       for key, group in zip(group_keys, db.get(group_keys)))
+        for membership in memberships:
+            if membership.key().name() not in rosters[membership.group_key]:
+                run_in_xg_transaction(_delete_orphan, membership.key())
+    for group in Group.all():
+        roster = snapshot(group)
+        user_ids = list(roster)
+        memberships = db.get([Membership.key_for(user_id)
+                              for user_id in user_ids])
+        stale = [user_id for user_id, membership in zip(user_ids, memberships)
+                 if membership is None or
+                 (membership.group_key == group.key() and
+                  membership.status != roster[user_id][1])]
+        sync_memberships(group.key(), stale)
+
+
+def _delete_orphan(key):
+    """Deletes a membership entry if it isn't on its group's roster."""
+    membership = db.get(key)
+    if membership is None:
+        return
+    group = db.get(membership.group_key)
+    if group is None or key.name() not in snapshot(group):
+        db.delete(key)
+
+
+def rebuild_names():
+    """Repairs the group name reservations from the names of every group.
+
+    Missing reservations are added first, and then reservations that don't
+    match the name of the group holding them are deleted, each checked again
+    in the transaction that writes it. If several groups share a name, only
+    the first one found keeps it. Nothing that is right is removed, so groups
+    can keep being created and renamed while this runs.
+    """
+    for batch in _batches(Group.all()):
+        reservations = db.get([GroupName.key_for(group.name)
+                               for group in batch])
+        for group, reservation in zip(batch, reservations):
+            if reservation is None or reservation.group_key != group.key():
+                run_in_xg_transaction(_reserve, group.key())
+    for batch in _batches(GroupName.all()):
+        holders = db.get([reservation.group_key for reservation in batch])
+        for reservation, group in zip(batch, holders):
+            if (group is None or
+                    GroupName.key_for(group.name) != reservation.key()):
+                run_in_xg_transaction(_release, reservation.key())
+
+
+def _reserve(key):
+    """Reserves the name of a group unless another group holds it."""
+    group = db.get(key)
+    if group is None:
+        return
+    reservation = db.get(GroupName.key_for(group.name))
+    if reservation is not None:
+        holder = db.get(reservation.group_key)
+        if (holder is not None and
+                GroupName.key_for(holder.name) == reservation.key()):
+            return
+    GroupName(key=GroupName.key_for(group.name), group=group).put()
+
+
+def _release(key):
+    """Deletes a name reservation if its group no longer has the name."""
+    reservation = db.get(key)
+    if reservation is None:
+        return
+    group = db.get(reservation.group_key)
+    if group is None or GroupName.key_for(group.name) != key:
+        db.delete(key)
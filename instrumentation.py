@@ -0,0 +1,167 @@
+"""Per-request instrumentation of datastore RPCs, rendering and handlers.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+Middleware wraps the WSGI application and collects, for every request, the
+number and duration of datastore RPCs along with the time spent in handlers
+and rendering templates. The totals are added to the response as X-Stats-*
+headers and logged as a single JSON line. Queries and single entity gets
+that are repeated with the same shape more than N_PLUS_ONE_THRESHOLD times
+in one request, which usually means something is being fetched once per row
+of a list, are logged as warnings.
+"""
+import collections
+import contextlib
+import json
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+
+import settings
+
+_local = threading.local()
+
+
+class Stats(object):
+    """Measurements collected during a single request."""
+    def __init__(self, path):
+        self.path = path
+        self.start = time.time()
+        self.rpcs = 0
+        self.rpc_time = 0.0
+        self.timers = collections.defaultdict(float)
+        self.shapes = collections.defaultdict(int)
+        self._started = {}
+
+    def rpc_started(self, request):
+        """Records the start of a datastore RPC."""
+        self._started[id(request)] = time.time()
+
+    def rpc_finished(self, call, request):
+        """Records the end of a datastore RPC."""
+        start = self._started.pop(id(request), None)
+        if start is not None:
+            self.rpc_time += time.time() - start
+        self.rpcs += 1
+        shape = _shape(call, request)
+        if shape is not None:
+            self.shapes[shape] += 1
+
+    def repeated(self):
+        """Returns a dict of shapes repeated above the threshold to counts."""
+        return dict((shape, count) for shape, count in self.shapes.items()
+                    if count > settings.N_PLUS_ONE_THRESHOLD)
+
+    def summary(self):
+        """Returns a dict of the totals for the request."""
+        summary = {'path': self.path,
+                   'total_ms': _ms(time.time() - self.start),
+                   'datastore_rpcs': self.rpcs,
+                   'datastore_ms': _ms(self.rpc_time),
+                   'repeated': self.repeated()}
+        for name, elapsed in self.timers.items():
+            summary['%s_ms' % name] = _ms(elapsed)
+        return summary
+
+    def headers(self):
+        """Returns the totals as a list of response headers."""
+        headers = [('X-Stats-Datastore-Rpcs', str(self.rpcs)),
+                   ('X-Stats-Datastore-Ms', str(_ms(self.rpc_time))),
+                   ('X-Stats-Repeated-Queries', str(len(self.repeated()))),
+                   ('X-Stats-Total-Ms', str(_ms(time.time() - self.start)))]
+        for name, elapsed in sorted(self.timers.items()):
+            headers.append(('X-Stats-%s-Ms' % name.capitalize(),
+                            str(_ms(elapsed))))
+        return headers
+
+
+def _ms(seconds):
+    """Converts a duration in seconds to milliseconds."""
+    return round(seconds * 1000, 1)
+
+
+def _shape(call, request):
+    """Describes a datastore request without the values it refers to.
+
+    Only queries and gets of a single entity are described, since those are
+    the calls that pile up when something is fetched once per row.
+    """
+    if call == 'RunQuery':
+        filters = ','.join('%s%d' % (f.property(0).name(), f.op())
+                           for f in request.filter_list())
+        orders = ','.join('%s%d' % (o.property(), o.direction())
+                          for o in request.order_list())
+        ancestor = ' ancestor' if request.has_ancestor() else ''
+        return 'query %s [%s] [%s]%s' % (request.kind(), filters, orders,
+                                         ancestor)
+    elif call == 'Get' and request.key_size() == 1:
+        return 'get %s' % request.key(0).path().element_list()[-1].type()
+    return None
+
+
+def current():
+    """Returns the Stats of the current request, or None."""
+    return getattr(_local, 'stats', None)
+
+
+@contextlib.contextmanager
+def timed(name):
+    """Adds the time spent in the with block to the named timer."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        stats = current()
+        if stats is not None:
+            stats.timers[name] += time.time() - start
+
+
+def _pre_call(service, call, request, response):
+    stats = current()
+    if stats is not None:
+        stats.rpc_started(request)
+
+
+def _post_call(service, call, request, response):
+    stats = current()
+    if stats is not None:
+        stats.rpc_finished(call, request)
+
+
+def install_hooks():
+    """Registers the RPC hooks with the API proxy. Safe to call repeatedly."""
+    apiproxy = apiproxy_stub_map.apiproxy
+    apiproxy.GetPreCallHooks().Append('instrumentation', _pre_call,
+                                      'datastore_v3')
+    apiproxy.GetPostCallHooks().Append('instrumentation', _post_call,
+                                       'datastore_v3')
+
+
+class Middleware(object):
+    """WSGI middleware that instruments every request to an application."""
+    def __init__(self, app):
+        self.app = app
+        install_hooks()
+
+    def __call__(self, environ, start_response):
+        stats = Stats(environ.get('PATH_INFO', ''))
+        _local.stats = stats
+
+        def instrumented_start_response(status, headers, exc_info=None):
+            # webapp2 only starts the response once the handler is done, so
+            # the stats are complete by now
+            summary = stats.summary()
+            logging.info('request stats: %s', json.dumps(summary,
+                                                         sort_keys=True))
+            for shape, count in summary['repeated'].items():
+                logging.warning('%s repeated %d times while serving %s',
+                                shape, count, stats.path)
+            return start_response(status, list(headers) + stats.headers(),
+                                  exc_info)
+
+        try:
+            return self.app(environ, instrumented_start_response)
+        finally:
+            _local.stats = None
@@ -0,0 +1,195 @@
+"""The project standings, kept up to date as votes and projects change.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+The standings are stored in a single Leaderboard entity, so showing them
+costs one get no matter how many projects or votes there are. Every change
+that affects them updates the entity in a transaction. Votes don't write it
+themselves, since every voter would then write the same entity. Instead the
+vote flush task copies the totals of the projects it changed from their vote
+counters with refresh(), so the standings are written at most once per flush
+however many votes come in.
+"""
+import json
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+
+import votes
+from models import Group, Leaderboard, Project
+
+ADD_PROJECTS_URL = '/tasks/leaderboard/add'
+
+
+def _load():
+    """Returns the leaderboard entity, creating it if it doesn't exist."""
+    return (Leaderboard.get_by_key_name(Leaderboard.KEY_NAME) or
+            Leaderboard(key_name=Leaderboard.KEY_NAME, standings='[]'))
+
+
+def _update(func):
+    """Applies func to the list of rows in a transaction and re-ranks them.
+
+    func receives a dict of project key strings to rows and may modify it in
+    place. It returns False if nothing changed, to skip the write.
+
+    Returns: True if the standings were written.
+    """
+    def txn():
+        board = _load()
+        rows = dict((row['key'], row) for row in json.loads(board.standings))
+        if func(rows) is False:
+            return False
+        ranked = sorted(rows.values(),
+                        key=lambda row: (-row['votes'], row['name'].lower()))
+        board.standings = json.dumps(ranked)
+        board.put()
+        return True
+
+    return db.run_in_transaction(txn)
+
+
+def _row(project, votes=0):
+    """Returns a new row for a project."""
+    return {'key': str(project.key()),
+            'name': project.name or '',
+            'votes': votes,
+            'groups': []}
+
+
+def standings():
+    """Returns the ranked list of projects.
+
+    Each entry is a dict with the project's key, name, vote count, rank and
+    the groups that claimed it, as a list of dicts with a key and name.
+    """
+    board = Leaderboard.get_by_key_name(Leaderboard.KEY_NAME)
+    rows = json.loads(board.standings) if board else []
+    rank = 0
+    for i, row in enumerate(rows):
+        if i == 0 or row['votes'] != rows[i - 1]['votes']:
+            rank = i + 1
+        row['rank'] = rank
+    return rows
+
+
+def refresh(project_keys):
+    """Copies some projects' totals from their vote counters to the standings.
+
+    Only the given projects' counters are read, and the standings are only
+    written if a total changed. Totals are read rather than adjusted, so
+    running this again for the same projects does no harm. rebuild()
+    reconciles every project.
+
+    Arguments:
+    project_keys: the keys of the projects whose totals may have changed.
+
+    Returns: True if any total changed.
+    """
+    if not project_keys:
+        return False
+    totals = dict((str(key), total)
+                  for key, total in votes.counts(list(project_keys)).items())
+
+    def apply(rows):
+        changed = False
+        for key, total in totals.items():
+            row = rows.get(key)
+            if row is not None and row['votes'] != total:
+                row['votes'] = total
+                changed = True
+        return changed
+
+    return _update(apply)
+
+
+def add_projects(projects):
+    """Adds new projects to the standings with their current totals.
+
+    Projects already in the standings are left alone, so this can be run
+    again after a failure.
+    """
+    totals = votes.counts([project.key() for project in projects])
+
+    def apply(rows):
+        new = [project for project in projects
+               if str(project.key()) not in rows]
+        for project in new:
+            rows[str(project.key())] = _row(project, totals[project.key()])
+        return bool(new)
+
+    if projects:
+        _update(apply)
+
+
+def queue_projects(project_keys):
+    """Queues a task that adds new projects to the standings.
+
+    This must be called in the transaction that creates the projects, so
+    they reach the standings if and only if they are committed.
+    """
+    taskqueue.add(url=ADD_PROJECTS_URL,
+                  params={'project': [str(key) for key in project_keys]},
+                  transactional=True)
+
+
+def remove_project(project_key):
+    """Removes a deleted project from the standings."""
+    def apply(rows):
+        return rows.pop(str(project_key), None) is not None
+
+    _update(apply)
+
+
+def update_group(group):
+    """Records the project a group has claimed, or that it has none.
+
+    This is idempotent, so it can be called after any change to a group.
+    """
+    group_key = str(group.key())
+    project_key = Group.project.get_value_for_datastore(group)
+
+    def apply(rows):
+        before = json.dumps(rows, sort_keys=True)
+        for row in rows.values():
+            row['groups'] = [g for g in row['groups'] if g['key'] != group_key]
+        if project_key is not None and str(project_key) in rows:
+            rows[str(project_key)]['groups'].append({'key': group_key,
+                                                     'name': group.name})
+        return json.dumps(rows, sort_keys=True) != before
+
+    _update(apply)
+
+
+def remove_group(group_key):
+    """Removes a deleted group's claim from the standings."""
+    group_key = str(group_key)
+
+    def apply(rows):
+        changed = False
+        for row in rows.values():
+            claims = [g for g in row['groups'] if g['key'] != group_key]
+            changed = changed or len(claims) != len(row['groups'])
+            row['groups'] = claims
+        return changed
+
+    _update(apply)
+
+
+def rebuild():
+    """Recomputes the standings from every project, vote and group."""
+    projects = list(Project.all())
+    totals = votes.counts([project.key() for project in projects])
+    rows = dict((str(project.key()), _row(project, totals[project.key()]))
+                for project in projects)
+    for group in Group.all():
+        project_key = Group.project.get_value_for_datastore(group)
+        if project_key is not None and str(project_key) in rows:
+            rows[str(project_key)]['groups'].append({'key': str(group.key()),
+                                                     'name': group.name})
+
+    def replace(current):
+        current.clear()
+        current.update(rows)
+
+    _update(replace)
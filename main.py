@@ -20,62 +20,127 @@ limitations under the License.
 
 Description:
 Defines application routes and controllers.
+
+Only the handlers for the busiest pages live here. The rest are given to the
+router by name and imported the first time one of their routes is requested
+(or when the instance is warmed up), so they don't slow down instance start.
 """
 import webapp2
 
-import os
+import activity
 import auth
+import cache
+import groups
+import instrumentation
+import leaderboard
+import moderation
+import paging
+import search
 import settings
+import votes
+from base import RequestHandler, render_template
 from messages import Messages
-from models import Group, Idea, Project, Submission
-from google.appengine.ext.webapp import template
+from models import Group, Idea, Membership, Project, Submission
+from google.appengine.ext import db
+
+
+def render_fragments(kind, entities, **extra):
+    """Renders the list fragment of each entity and caches the result.
+
+    Each entity is rendered with the template fragments/<kind>.html. Only
+    markup that is the same for every visitor belongs in these templates;
+    anything that depends on the current user is rendered by the page itself.
+
+    Returns: a list of dicts with the entity's key and its rendered markup,
+             along with any extra values given as lists of the same length
+             as entities.
+    """
+    fragments = []
+    for i, entity in enumerate(entities):
+        fragment = dict((name, values[i]) for name, values in extra.items())
+        fragment['key'] = str(entity.key())
+        fragment['html'] = render_template('fragments/%s' % kind,
+                                           {kind: entity})
+        fragments.append(fragment)
+    return fragments
+
+
+def project_name(key):
+    """Returns the name of a project, or None if it doesn't exist.
+
+    Projects are never renamed, so names are cached for good and voting
+    doesn't fetch the project every time.
+    """
+    cache_key = 'project-name:%s' % key
+    name = cache.get(cache_key)
+    if name is None:
+        project = Project.get(key)
+        if project is None:
+            return None
+        name = project.name or ''
+        cache.put(cache_key, name)
+    return name
 
-class RequestHandler(webapp2.RequestHandler):
-    """Base request handler that handles site wide handling tasks."""
-    def render(self, template_name, data={}):
-        """Renders the template in the site wide manner.
 
-        Retrieves the template data needed for the base template (login URL and
-        text, user information, etc.) and merges it with the data passed to the
-        method. Templates are retrieved from the template directory specified
-        in the settings and appended with the suffix ".html"
+def cached_page(kind, model, order, request, render):
+    """Returns the page of a listing requested, rendered and cached.
 
-        Arguments:
-        template_name: the name of the template. this is the file name of the
-                       template without the .html extension.
+    Arguments:
+    kind:    the kind of entity listed, as passed to cache.bump.
+    model:   the model class to list.
+    order:   the property to sort on, prefixed with '-' for descending order.
+    request: the request, which may hold the page size and bookmarks.
+    render:  a function taking a list of entities and returning their
+             rendered fragments.
 
-        data: a dictionary containing data to be passed to the template.
-        """
-        (login_text, login_url) = auth.login_logout(self.request)
+    Returns: a paging.Page whose items are the rendered fragments.
+    """
+    size, after, before = paging.params(request)
 
-        if auth.logged_in():
-            data['user'] = auth.User(auth.current_user())
+    def build():
+        page = paging.fetch(model, order, size, after, before)
+        page.items = render(page.items)
+        return page
 
-        data['admin'] = auth.user_is_admin()
-        data['login_url'] = login_url
-        data['login_text'] = login_text
-        data['messages'] = Messages.get()
-
-        path = os.path.join(settings.BASE_DIR, settings.TEMPLATE_DIR,
-                        "%s.html" % template_name)
-
-        return self.response.out.write(template.render(path, data))
+    return cache.memoize(kind, 'page:%s:%s:%s' % (size, after, before), build)
 
 
 class ProjectsHandler(RequestHandler):
     """Handler for all project related requests."""
     def get(self):
-        """Displays a list of all projects."""
-        return self.render('projects', {'projects': Project.all()})
+        """Displays a page of the list of projects, newest first."""
+        def render(projects):
+            keys = [project.key() for project in projects]
+            totals = votes.counts(keys)
+            return render_fragments('project', projects,
+                                    votes=[totals[key] for key in keys])
+
+        page = cached_page('project', Project, '-post_time', self.request,
+                           render)
+        # copied so the per-user totals don't leak into the cached page
+        projects = [dict(project) for project in page.items]
+        if auth.logged_in():
+            totals = votes.include_pending(
+                dict((db.Key(project['key']), project['votes'])
+                     for project in projects),
+                auth.current_user())
+            for project in projects:
+                project['votes'] = totals[db.Key(project['key'])]
+        return self.render('projects', {'projects': projects, 'page': page})
 
     def claim(self, key):
         """Claims a project for a group."""
-        user = auth.User(auth.current_user())
+        user = auth.get_user()
         group = user.group
         if group.owner.user_id() == auth.current_user().user_id():
             project = Project.get(key)
-            group.project = project
-            group.put()
+
+            def change(group):
+                group.project = project
+
+            group = groups.save(group.key(), change)
+            leaderboard.update_group(group)
+            cache.bump('group')
             return self.redirect('/groups/%s' % group.key())
         else:
             Messages.add('You are not the owner of your group. Only the ' +
@@ -90,19 +155,24 @@ class ProjectsHandler(RequestHandler):
         """
         if not auth.logged_in():
             return self.redirect('/projects')
-        project = Project.get(key)
-        if project.has_voted(auth.current_user()):
-            project.remove_vote(auth.current_user())
-            project.put()
-        else:
-            project.vote(auth.current_user())
-            project.put()
+        voted = votes.cast(db.Key(key), auth.current_user())
+        if not settings.VOTE_WRITE_BEHIND:
+            cache.bump('project')
+        if voted:
+            name = project_name(key)
+            if name is not None:
+                activity.record('vote', 'Someone voted on %s' % name,
+                                '/projects')
         return self.redirect('/projects')
 
     def delete(self, key):
         """Deletes a project."""
         if auth.user_is_admin():
-            Project.get(key).delete()
+            votes.delete(db.Key(key))
+            db.delete(db.Key(key))
+            search.unindex(key)
+            leaderboard.remove_project(key)
+            cache.bump('project')
         else:
             Messages.add('Only and administrator may delete projects. This ' +
                          'incident has been logged.')
@@ -112,27 +182,28 @@ class ProjectsHandler(RequestHandler):
 class IdeasHandler(RequestHandler):
     """Handler for all project idea related requests."""
     def get(self):
-        """Displays a list of all project ideas."""
-        return self.render('ideas', {'ideas': Idea.all()})
+        """Displays a page of the list of project ideas, newest first."""
+        page = cached_page('idea', Idea, '-post_time', self.request,
+                           lambda ideas: render_fragments('idea', ideas))
+        return self.render('ideas', {'ideas': page.items, 'page': page})
 
     def post(self):
         """Posts a new project idea."""
         name = self.request.get('name')
         description = self.request.get('description')
-        Idea(name=name,
-            description=description,
-            author=auth.current_user()).put()
+        idea = Idea(name=name,
+                    description=description,
+                    author=auth.current_user())
+        idea.put()
+        search.index(idea)
+        cache.bump('idea')
+        activity.record('idea', 'New idea: %s' % idea.name, '/ideas')
         return self.redirect('/ideas')
 
     def approve(self, key):
         """Promotes a project idea to an accepted project."""
         if auth.user_is_admin():
-            idea = Idea.get(key)
-            Project(name=idea.name,
-                    description=idea.description,
-                    author=idea.author,
-                    post_time=idea.post_time).put()
-            idea.delete()
+            self.approved(moderation.approve([key]))
             return self.redirect('/projects')
         else:
             Messages.add('Only and administrator may approve submitted ' +
@@ -142,23 +213,69 @@ class IdeasHandler(RequestHandler):
     def delete(self, key):
         """Deletes a project idea."""
         if auth.user_is_admin():
-            Idea.get(key).delete()
+            moderation.reject([key])
+            cache.bump('idea')
         else:
             Messages.add('Only and administrator may delete submitted ' +
                          'ideas. This incident has been logged.')
         return self.redirect('/ideas')
 
+    def moderate(self):
+        """Approves or deletes many project ideas at once.
+
+        Form Variables:
+            idea:   the keys of the ideas to moderate
+            action: approve to promote the ideas to projects, or reject to
+                    delete them
+        """
+        if not auth.user_is_admin():
+            Messages.add('Only and administrator may moderate submitted ' +
+                         'ideas. This incident has been logged.')
+            return self.redirect('/ideas')
+
+        keys = self.request.get_all('idea')
+        action = self.request.get('action')
+        if action == 'approve':
+            projects = moderation.approve(keys)
+            self.approved(projects)
+            Messages.add('Approved %d ideas' % len(projects))
+        elif action == 'reject':
+            ideas = moderation.reject(keys)
+            cache.bump('idea')
+            Messages.add('Deleted %d ideas' % len(ideas))
+        else:
+            return self.abort(400, 'action must be approve or reject')
+        return self.redirect('/ideas')
+
+    def approved(self, projects):
+        """Updates the caches and live feed for new projects.
+
+        The projects are added to the standings by a task queued when they
+        were approved.
+        """
+        cache.bump('idea')
+        cache.bump('project')
+        for project in projects:
+            activity.record('approval', '%s is now a project' % project.name,
+                            '/projects')
+
 
 class GroupsHandler(RequestHandler):
     """Handler for all group related requests."""
     def get(self):
-        """Displays a list of all groups."""
-        return self.render('groups_list', {'groups': Group.all()})
+        """Displays a page of the list of groups, sorted by name."""
+        page = cached_page('group', Group, 'name', self.request,
+                           lambda entities: render_fragments('group',
+                                                             entities))
+        return self.render('groups_list', {'groups': page.items, 'page': page})
 
     def show(self, key):
         """Displays details about a group."""
         if self.request.method == 'GET':
-            return self.render('groups_show', {'group': Group.get(key)})
+            data = groups.details(key, auth.get_user())
+            if data is None:
+                return self.abort(404)
+            return self.render('groups_show', data)
         elif self.request.method == 'POST':
             self.update_group(key)
         else:
@@ -166,40 +283,38 @@ class GroupsHandler(RequestHandler):
 
     def join(self, key):
         """Adds the current user to the group's roster."""
-        group = Group.get(key)
-        user = auth.User(auth.current_user())
-        if user.in_group():
-            Messages.add('You are already in a group')
-            return self.redirect('/groups/%s' % key)
-        if user.pending_join():
-            Messages.add('You have already applied to join a group')
+        try:
+            group = groups.join(key, auth.current_user())
+        except groups.AlreadyInGroup as e:
+            if e.status == Membership.PENDING:
+                Messages.add('You have already applied to join a group')
+            else:
+                Messages.add('You are already in a group')
             return self.redirect('/groups/%s' % key)
+        if group is None:
+            return self.abort(404)
         if group.public:
-            group.members.append(auth.current_user())
             Messages.add('You have joined the group')
+            activity.record('join', '%s joined %s' %
+                            (auth.current_user().nickname(), group.name),
+                            '/groups/%s' % key)
         else:
-            group.pending_users.append(auth.current_user())
             Messages.add('You have requested to join the group')
-        group.put()
         return self.redirect('/groups/%s' % key)
 
     def leave(self, key):
         """Removes the current user from the group's roster."""
-        group = Group.get(key)
-        user = auth.User(auth.current_user())
-
-        if user.group != group:
+        try:
+            groups.leave(key, auth.current_user())
+        except groups.NotInGroup:
             Messages.add('You cannot leave a group you are not in')
             return self.redirect('/groups/%s' % key)
-
-        group.members.remove(user.gae_user)
-        group.put()
         return self.redirect('/groups')
 
     def signup(self):
         """Displays the group sign up form."""
-        user = auth.User(auth.current_user())
-        if user.in_group():
+        user = auth.get_user()
+        if user is not None and user.in_group():
             Messages.add('You are already in a group')
             return self.redirect('/groups')
         else:
@@ -217,14 +332,17 @@ class GroupsHandler(RequestHandler):
             public = self.request.get('public') == 'public'
             owner = auth.current_user()
 
-            if Group.exists(name):
+            try:
+                group = groups.create(name, public, owner)
+            except groups.NameTaken:
                 Messages.add('A group with that name already exists')
                 return self.redirect('/groups/signup')
-
-            Group(name=name,
-                  public=public,
-                  owner=owner,
-                  members=[owner]).put()
+            except groups.AlreadyInGroup:
+                Messages.add('You are already in a group')
+                return self.redirect('/groups')
+            cache.bump('group')
+            activity.record('group', 'New group: %s' % name,
+                            '/groups/%s' % group.key())
 
             return self.redirect('/groups')
         else:
@@ -237,9 +355,12 @@ class GroupsHandler(RequestHandler):
             return self.redirect('/groups')
 
         user = auth.current_user()
-        group = Group.get(key)
+        data = groups.details(key, auth.get_user())
+        if data is None:
+            return self.abort(404)
+        group = data['group']
         if group.owner.user_id() == user.user_id() or auth.user_is_admin():
-            return self.render('groups_edit', {'group': group})
+            return self.render('groups_edit', data)
         else:
             Messages.add('Only the owner of this group may edit it')
             return self.redirect('/groups/%s' % key)
@@ -247,7 +368,9 @@ class GroupsHandler(RequestHandler):
     def delete(self, key):
         """Deletes a group."""
         if auth.user_is_admin():
-            Group.get(key).delete()
+            groups.delete(key)
+            leaderboard.remove_group(key)
+            cache.bump('group')
         else:
             Messages.add('Only an administrator may delete groups. This ' +
                          'incident has been logged.')
@@ -275,6 +398,8 @@ class GroupsHandler(RequestHandler):
 
         user = auth.current_user()
         group = Group.get(key)
+        if group is None:
+            return self.abort(404)
         if (group.owner.user_id() != user.user_id() and
                 not auth.user_is_admin()):
             Messages.add('Only the owner of the group owner may modify it')
@@ -291,82 +416,84 @@ class GroupsHandler(RequestHandler):
         delete = self.request.get('delete')
 
         if delete:
-            group.delete()
+            groups.delete(key)
+            leaderboard.remove_group(key)
+            cache.bump('group')
             return self.redirect('/groups')
 
-        group.name = name
-        group.public = public
-
-        if abandon:
-            group.project = None
-
+        puts = []
         if sub_text and sub_url:
-            Submission(text=sub_text, url=sub_url, group=group).put()
-
-        for sub in Submission.get(remove_submission):
-            sub.delete()
-
-        pending = list(group.pending_users)
-        for user in pending:
-            approve = self.request.get("approve-%s" % user)
-            if approve == "approve":
-                group.members.append(user)
-                group.pending_users.remove(user)
-            elif approve == "refuse":
-                group.pending_users.remove(user)
-
-        group.owner = auth.user_from_email(owner)
-
-        for user in remove:
-            if auth.user_from_email(user) == group.owner:
-                Messages.add('Cannot remove the group owner')
-                return self.redirect('/groups/%s/edit' % key)
-            else:
-                group.members.remove(auth.user_from_email(user))
-
-        group.put()
+            puts.append(Submission(parent=group,
+                                   text=sub_text,
+                                   url=sub_url,
+                                   group=group))
+
+        deletes = [sub.key()
+                   for sub in Submission.get(remove_submission)
+                   if sub is not None and sub.group_key == group.key()]
+
+        approved = set()
+
+        def change(group):
+            """Applies the form to the group as it is in the transaction."""
+            group.name = name
+            group.public = public
+            if abandon:
+                group.project = None
+
+            # form values name users by their nickname or email address
+            roster = {}
+            for user in group.members + group.pending_users:
+                roster[unicode(user)] = user
+                roster[user.email()] = user
+
+            decisions = dict((user.email(),
+                              self.request.get("approve-%s" % user))
+                             for user in group.pending_users)
+            approved.clear()
+            approved.update(email for email, decision in decisions.items()
+                            if decision == "approve")
+            refused = set(email for email, decision in decisions.items()
+                          if decision == "refuse")
+
+            if owner in roster:
+                group.owner = roster[owner]
+            elif owner:
+                group.owner = auth.user_from_email(owner)
+
+            removed = set(roster[value].email() if value in roster else value
+                          for value in remove)
+            if group.owner.email() in removed:
+                raise groups.OwnerRemoved()
+
+            group.members = ([user for user in group.members
+                              if user.email() not in removed] +
+                             [user for user in group.pending_users
+                              if user.email() in approved])
+            group.pending_users = [user for user in group.pending_users
+                                   if user.email() not in approved | refused]
+
+        try:
+            group = groups.save(key, change, puts, deletes)
+        except groups.NameTaken:
+            Messages.add('A group with that name already exists')
+            return self.redirect('/groups/%s/edit' % key)
+        except groups.OwnerRemoved:
+            Messages.add('Cannot remove the group owner')
+            return self.redirect('/groups/%s/edit' % key)
+        if group is None:
+            return self.abort(404)
+        leaderboard.update_group(group)
+        cache.bump('group')
+        for user in group.members:
+            if user.email() in approved:
+                activity.record('join', '%s joined %s' %
+                                (user.nickname(), group.name),
+                                '/groups/%s' % key)
         return self.redirect('/groups/%s' % key)
 
 
-class LiveHandler(RequestHandler):
-    """Handler for live feed requests."""
-    def get(self):
-        """Display the live feed."""
-        return self.render('live')
-
-
-class AboutHandler(RequestHandler):
-    """Handler for about requests."""
-    def get(self):
-        """Displays the about page."""
-        return self.render('about')
-
-
-class FAQHandler(RequestHandler):
-    """Handler for FAQ requests."""
-    def get(self):
-        """Displays the FAQ page."""
-        return self.render('faq')
-
-class TutHandler(RequestHandler):
-    """Handler for Tutorial requests."""
-    def get(self):
-        """Displays the Tutorial page."""
-        return self.render('tutorial')
-
-class EntryHandler(RequestHandler):
-    """Handler for Entry requests."""
-    def get(self):
-        """Displays the Results page."""
-        return self.render('entry')
-
-class ResultsHandler(RequestHandler):
-    """Handler for Results requests."""
-    def get(self):
-        """Displays the Results page."""
-        return self.render('results')
-
-app = webapp2.WSGIApplication([
+application = webapp2.WSGIApplication([
     ('/', ProjectsHandler),
     ('/projects', ProjectsHandler),
     webapp2.Route(r'/projects/<key>/delete', name='projects_delete',
@@ -376,6 +503,9 @@ app = webapp2.WSGIApplication([
     webapp2.Route(r'/projects/<key>/claim', name='projects_claim',
                   handler=ProjectsHandler, handler_method='claim'),
     ('/ideas', IdeasHandler),
+    webapp2.Route(r'/ideas/moderate', name='ideas_moderate',
+                  handler=IdeasHandler, handler_method='moderate',
+                  methods=['POST']),
     webapp2.Route(r'/ideas/<key>/approve', name='ideas_approve',
                   handler=IdeasHandler, handler_method='approve'),
     webapp2.Route(r'/ideas/<key>/delete', name='ideas_delete',
@@ -396,10 +526,49 @@ app = webapp2.WSGIApplication([
                   handler=GroupsHandler, handler_method='join'),
     webapp2.Route(r'/groups/<key>/leave', name='groups_leave',
                   handler=GroupsHandler, handler_method='leave'),
-    ('/live', LiveHandler),
-    ('/about', AboutHandler),
-    ('/faq', FAQHandler),
-    ('/entry', EntryHandler),
-    ('/tutorial', TutHandler),
-    ('/results', ResultsHandler),
+    webapp2.Route(r'/admin/reindex', name='admin_reindex',
+                  handler='admin.AdminHandler', handler_method='reindex'),
+    webapp2.Route(r'/tasks/votes/flush', name='tasks_flush_votes',
+                  handler='admin.TaskHandler', handler_method='flush_votes'),
+    webapp2.Route(r'/tasks/leaderboard/add', name='tasks_add_projects',
+                  handler='admin.TaskHandler', handler_method='add_projects',
+                  methods=['POST']),
+    webapp2.Route(r'/admin/export', name='admin_export',
+                  handler='admin.AdminHandler', handler_method='export_data'),
+    webapp2.Route(r'/admin/stats', name='admin_stats',
+                  handler='admin.AdminHandler', handler_method='stats'),
+    webapp2.Route(r'/admin/stats.json', name='admin_stats_status',
+                  handler='admin.AdminHandler',
+                  handler_method='stats_status'),
+    webapp2.Route(r'/admin/stats/refresh', name='admin_stats_refresh',
+                  handler='admin.AdminHandler',
+                  handler_method='refresh_stats', methods=['POST']),
+    webapp2.Route(r'/tasks/groups/memberships', name='tasks_sync_memberships',
+                  handler='admin.TaskHandler',
+                  handler_method='sync_memberships', methods=['POST']),
+    webapp2.Route(r'/tasks/stats/start', name='tasks_start_stats',
+                  handler='admin.TaskHandler', handler_method='start_stats'),
+    webapp2.Route(r'/tasks/stats/step', name='tasks_stats_step',
+                  handler='admin.TaskHandler', handler_method='stats_step',
+                  methods=['POST']),
+    webapp2.Route(r'/_ah/warmup', name='warmup',
+                  handler='admin.WarmupHandler', handler_method='warmup'),
+    ('/search', 'pages.SearchHandler'),
+    ('/live', 'pages.LiveHandler'),
+    webapp2.Route(r'/live/events', name='live_events',
+                  handler='pages.LiveHandler', handler_method='events'),
+    ('/about', 'pages.AboutHandler'),
+    ('/faq', 'pages.FAQHandler'),
+    ('/entry', 'pages.EntryHandler'),
+    ('/tutorial', 'pages.TutHandler'),
+    ('/results', 'pages.ResultsHandler'),
+    webapp2.Route(r'/results.json', name='results_json',
+                  handler='pages.ResultsHandler', handler_method='standings'),
+    webapp2.Route(r'/stats/paint', name='stats_paint',
+                  handler='pages.PaintHandler', methods=['POST']),
 ], debug=True)
+
+if settings.INSTRUMENTATION:
+    app = instrumentation.Middleware(application)
+else:
+    app = application
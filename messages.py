@@ -1,7 +1,55 @@
 """Module for handling messages that need to be displayed to the user.
 
 Author: Dan Albert <dan@gingerhq.net>
+
+Messages are kept in the visitor's session, a cookie signed with a secret
+key, so they follow the visitor from the request that adds them to the page
+that shows them without any datastore work, and requests served at the same
+time by one instance never see each other's messages. The signing key is
+generated once and stored in the datastore, and each instance reads it the
+first time it is needed.
 """
+import binascii
+import os
+
+import webapp2
+from webapp2_extras import sessions
+
+from models import Secret
+
+COOKIE_NAME = 'session'
+
+# the session entry the messages are kept under
+FLASH_KEY = '_messages'
+
+# the key of the store in the request registry
+_REGISTRY_KEY = 'messages.store'
+
+_secret_key = None
+
+
+def secret_key():
+    """Returns the key sessions are signed with, creating it if needed."""
+    global _secret_key
+    if _secret_key is None:
+        secret = Secret.get_or_insert('sessions',
+                                      value=binascii.hexlify(os.urandom(32)))
+        _secret_key = secret.value
+    return _secret_key
+
+
+def _store(create=True):
+    """Returns the session store of the current request."""
+    request = webapp2.get_request()
+    store = request.registry.get(_REGISTRY_KEY)
+    if store is None and create:
+        store = sessions.SessionStore(request, config={
+            'secret_key': secret_key(),
+            'cookie_name': COOKIE_NAME,
+            'cookie_args': {'httponly': True},
+        })
+        request.registry[_REGISTRY_KEY] = store
+    return store
 
 
 class Messages:
@@ -10,16 +58,25 @@ class Messages:
     Messages can be added at any time, and retrieving messages clears the list.
     This ensures that messages will only be displayed once.
     """
-    messages = []
-
     @classmethod
     def add(cls, msg):
         """Adds a messages to the message list."""
-        cls.messages.append(msg)
+        _store().get_session().add_flash(msg, key=FLASH_KEY)
+
+    @classmethod
+    def pending(cls):
+        """Returns True if there are messages waiting to be displayed."""
+        return bool(_store().get_session().get(FLASH_KEY))
 
     @classmethod
     def get(cls):
         """Retrieves all messages and clears the list."""
-        msgs = cls.messages
-        cls.messages = []
-        return msgs
+        return [msg for msg, _ in
+                _store().get_session().get_flashes(key=FLASH_KEY)]
+
+    @classmethod
+    def save(cls, response):
+        """Stores any change to the messages in the response's cookie."""
+        store = _store(create=False)
+        if store is not None:
+            store.save_sessions(response)
@@ -6,6 +6,12 @@ from google.appengine.ext import db
 from google.appengine.api import users
 
 
+def run_in_xg_transaction(func, *args, **kwargs):
+    """Runs func in a transaction that may span several entity groups."""
+    options = db.create_transaction_options(xg=True)
+    return db.run_in_transaction_options(options, func, *args, **kwargs)
+
+
 class Idea(db.Model):
     """A project idea."""
     name = db.StringProperty("Title of the project if the idea is approved")
@@ -27,24 +33,150 @@ class Project(db.Model):
     name = db.StringProperty("Project title")
     author = db.UserProperty("User that had the idea, or null if anonymous")
     description = db.TextProperty("Long description of the project")
-    post_time = db.DateTimeProperty("Idea submission time", auto_now_add=True)
-    votes = db.ListProperty(users.User)
+    post_time = db.DateTimeProperty("Approval time", auto_now_add=True)
+    # votes used to be stored here. they now live in the Vote ledger, and this
+    # is only kept so votes.migrate_legacy can move old projects over
+    legacy_votes = db.ListProperty(users.User, name='votes')
     # implicit member "groups" from the Group model
 
-    def has_voted(self, user):
-        """Returns true if the given user has voted for this project."""
-        return user in self.votes
+    @classmethod
+    def key_for_idea(cls, idea_key):
+        """Returns the key of the project an idea is approved as."""
+        return db.Key.from_path(cls.kind(), 'idea:%s' % idea_key)
+
+
+class Vote(db.Model):
+    """A single user's vote for a project.
+
+    Votes are keyed by project and user ID, so checking whether a user has
+    voted is a single get. Totals are kept separately in VoteCounterShards.
+    """
+    project = db.ReferenceProperty(Project, collection_name='vote_records')
+    user = db.UserProperty("The user that voted")
+    post_time = db.DateTimeProperty("Time of the vote", auto_now_add=True)
+
+    @classmethod
+    def key_for(cls, project_key, user_id):
+        """Returns the key of the vote a user would cast for a project."""
+        return db.Key.from_path(cls.kind(), '%s:%s' % (project_key, user_id))
+
+
+class PendingVote(db.Model):
+    """A vote that has been cast but not yet applied to the ledger.
+
+    Pending votes record whether the user wants their vote counted rather than
+    a toggle, so applying the same pending vote twice has no further effect.
+    They are children of a per-user key, which lets a user's own unapplied
+    votes be read back consistently while every vote is still a cheap write.
+    """
+    project = db.ReferenceProperty(Project, collection_name='pending_votes')
+    user = db.UserProperty("The user that voted")
+    voted = db.BooleanProperty("True to add the vote, False to remove it")
+    post_time = db.DateTimeProperty("Time of the vote", auto_now_add=True)
+
+    @classmethod
+    def parent_for(cls, user_id):
+        """Returns the key all of a user's pending votes are stored under."""
+        return db.Key.from_path('VoteQueue', user_id)
+
 
-    def vote(self, user):
-        """Adds the user's vote to this project."""
-        if not self.has_voted(user):
-            self.votes.append(user)
-        # TODO: else should probably bitch and moan, but our error handling
-        #       isn't so great right now
+class VoteCounterShard(db.Model):
+    """One part of a project's vote total.
 
-    def remove_vote(self, user):
-        """Removes the user's vote from this project."""
-        self.votes.remove(user)
+    The total for a project is split over several shards that are updated at
+    random, so that many people voting for the same project at once don't all
+    write to the same entity.
+    """
+    project = db.ReferenceProperty(Project, collection_name='vote_shards')
+    count = db.IntegerProperty("Votes counted by this shard", default=0)
+
+    @classmethod
+    def key_for(cls, project_key, shard):
+        """Returns the key of the given shard of a project's vote total."""
+        return db.Key.from_path(cls.kind(), '%s:%s' % (project_key, shard))
+
+
+class SearchPosting(db.Model):
+    """One word of an idea or project in the search index.
+
+    Postings are keyed by the word followed by the key of the entity it
+    appears in, so the postings of every word starting with a prefix can be
+    read with a single key range query. They are maintained by search.py.
+    """
+    MAX_WORD = 50
+    SEPARATOR = u'|'
+
+    doc = db.StringProperty("Key of the entity the word appears in")
+    weight = db.IntegerProperty("How relevant the word is to the entity",
+                                indexed=False)
+
+    @classmethod
+    def key_for(cls, word, doc):
+        """Returns the key of the posting of a word in an entity."""
+        return db.Key.from_path(cls.kind(), word + cls.SEPARATOR + doc)
+
+    @classmethod
+    def range_for(cls, prefix):
+        """Returns the (start, end) keys of postings of words with a prefix."""
+        return (db.Key.from_path(cls.kind(), prefix),
+                db.Key.from_path(cls.kind(), prefix + u'\ufffd'))
+
+    @property
+    def word(self):
+        """The word this posting is for."""
+        return self.key().name().split(self.SEPARATOR, 1)[0]
+
+
+class Leaderboard(db.Model):
+    """The ranked standings of every project, maintained by leaderboard.py.
+
+    There is only one leaderboard, stored under KEY_NAME, so the standings
+    can be read with a single get.
+    """
+    KEY_NAME = 'current'
+
+    standings = db.TextProperty("JSON list of ranked projects")
+    updated = db.DateTimeProperty("Time of the last change", auto_now=True)
+
+
+class StatsSnapshot(db.Model):
+    """The event statistics last computed by stats.py.
+
+    There is only one snapshot, stored under KEY_NAME, so the dashboard can
+    show it with a single get.
+    """
+    KEY_NAME = 'current'
+
+    stats = db.TextProperty("JSON object of the statistics")
+    started = db.DateTimeProperty("Time the computation started")
+    updated = db.DateTimeProperty("Time the computation finished",
+                                  auto_now=True)
+
+
+class StatsJob(db.Model):
+    """The progress of a run of the statistics job in stats.py.
+
+    The job walks one kind of entity after another, a chunk per task, and
+    saves its place and its totals so far here after every chunk. There is
+    at most one job, stored under KEY_NAME.
+    """
+    KEY_NAME = 'current'
+
+    kind = db.StringProperty("Kind of entity being walked", indexed=False)
+    cursor = db.TextProperty("Query cursor to resume the walk from")
+    partial = db.TextProperty("JSON object of the statistics so far")
+    step = db.IntegerProperty("Number of chunks processed", default=0)
+    started = db.DateTimeProperty("Time the job started", auto_now_add=True)
+    updated = db.DateTimeProperty("Time of the last chunk", auto_now=True)
+
+
+class Secret(db.Model):
+    """A random value generated the first time it is needed.
+
+    Secrets, such as the key that signs session cookies, are stored under a
+    key name saying what they are for.
+    """
+    value = db.StringProperty("The secret, hex encoded", indexed=False)
 
 
 class Group(db.Model):
@@ -55,6 +187,7 @@ class Group(db.Model):
     project = db.ReferenceProperty(Project, collection_name='groups')
     members = db.ListProperty(users.User)
     pending_users = db.ListProperty(users.User)
+    post_time = db.DateTimeProperty("Creation time", auto_now_add=True)
     # implicit member "submissions" from the submission model
 
     def __eq__(self, other):
@@ -65,10 +198,58 @@ class Group(db.Model):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+
+class GroupName(db.Model):
+    """Reservation of a group name.
+
+    Reservations are keyed by the normalized name, so checking whether a name
+    is in use is a single get, and reserving a name in the same transaction
+    as creating or renaming the group keeps two groups from taking it.
+    """
+    group = db.ReferenceProperty(Group, collection_name='name_reservations')
+
+    @staticmethod
+    def normalize(name):
+        """Returns the form of a name used to compare it with other names."""
+        return u' '.join((name or u'').lower().split())
+
     @classmethod
-    def exists(cls, name):
-        """Returns True if a group by the given name already exists."""
-        return Group.all().filter('name =', name).count() > 0
+    def key_for(cls, name):
+        """Returns the key of the reservation of the given name."""
+        # prefixed because key names may not be empty
+        return db.Key.from_path(cls.kind(), u'n:' + cls.normalize(name))
+
+    @property
+    def group_key(self):
+        """The key of the group holding the name, without fetching it."""
+        return GroupName.group.get_value_for_datastore(self)
+
+
+class Membership(db.Model):
+    """Index entry mapping a user to the group they are in or waiting to join.
+
+    Memberships are keyed by user ID so a user's group can be found with a
+    single get instead of scanning the roster of every group. The index is
+    maintained by the functions in the groups module and must be updated
+    whenever a group's members or pending_users change.
+    """
+    MEMBER = 'member'
+    PENDING = 'pending'
+
+    user = db.UserProperty("The user this entry belongs to")
+    group = db.ReferenceProperty(Group, collection_name='memberships')
+    status = db.StringProperty("Whether the user is a member or pending",
+                               choices=[MEMBER, PENDING])
+
+    @classmethod
+    def key_for(cls, user_id):
+        """Returns the key of the membership entry for the given user ID."""
+        return db.Key.from_path(cls.kind(), user_id)
+
+    @property
+    def group_key(self):
+        """The key of the indexed group, without fetching the group."""
+        return Membership.group.get_value_for_datastore(self)
 
 
 class Submission(db.Model):
@@ -81,6 +262,14 @@ class Submission(db.Model):
     url = db.LinkProperty("Link to submission")
     weight = db.IntegerProperty("Display order weight", default=0)
     group = db.ReferenceProperty(Group, collection_name='submissions')
+    post_time = db.DateTimeProperty("Submission time", auto_now_add=True)
+    # new submissions are also children of their group, so they can be
+    # written in the same transaction as it
+
+    @property
+    def group_key(self):
+        """The key of the submission's group, without fetching the group."""
+        return Submission.group.get_value_for_datastore(self)
 
     def to_a(self):
         """Returns the HTML anchor tag that represents this submission."""
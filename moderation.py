@@ -0,0 +1,84 @@
+"""Approval and rejection of submitted ideas, in bulk.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+Approving an idea replaces it with a Project. The project's key is derived
+from the idea's key, and the idea is deleted in the same transaction that
+writes the project, so an approval that fails part way or is retried can
+neither lose the idea nor create a second project for it. The same
+transaction queues the task that adds the project to the standings. The
+project's post_time is the time of approval, so incremental exports pick it
+up.
+
+Ideas are approved APPROVE_CHUNK at a time, each chunk in one cross-group
+transaction with one batch get, put and delete. Every idea and project is its
+own entity group and a transaction may span at most 25 of them.
+"""
+from google.appengine.ext import db
+
+import leaderboard
+import search
+from models import Idea, Project, run_in_xg_transaction
+
+APPROVE_CHUNK = 12
+REJECT_CHUNK = 500
+
+
+def _keys(keys):
+    """Converts key strings to keys."""
+    return [db.Key(key) if isinstance(key, basestring) else key
+            for key in keys]
+
+
+def _promote(idea_keys):
+    """Replaces ideas with projects. Runs in a transaction.
+
+    Returns: a tuple of the list of ideas that were replaced and the list of
+             their new projects.
+    """
+    ideas = [idea for idea in db.get(idea_keys) if isinstance(idea, Idea)]
+    projects = [Project(key=Project.key_for_idea(idea.key()),
+                        name=idea.name,
+                        description=idea.description,
+                        author=idea.author)
+                for idea in ideas]
+    db.put(projects)
+    db.delete(ideas)
+    if projects:
+        leaderboard.queue_projects([project.key() for project in projects])
+    return (ideas, projects)
+
+
+def approve(idea_keys):
+    """Promotes ideas to projects and moves them in the search index.
+
+    Ideas that no longer exist, because they have already been approved or
+    rejected, are skipped.
+
+    Returns: the list of new projects.
+    """
+    idea_keys = _keys(idea_keys)
+    projects = []
+    for i in range(0, len(idea_keys), APPROVE_CHUNK):
+        (ideas, promoted) = run_in_xg_transaction(
+            _promote, idea_keys[i:i + APPROVE_CHUNK])
+        search.unindex_many(ideas)
+        search.index_many(promoted)
+        projects.extend(promoted)
+    return projects
+
+
+def reject(idea_keys):
+    """Deletes ideas and removes them from the search index.
+
+    Returns: the list of ideas that were deleted.
+    """
+    idea_keys = _keys(idea_keys)
+    rejected = []
+    for i in range(0, len(idea_keys), REJECT_CHUNK):
+        ideas = [idea for idea in db.get(idea_keys[i:i + REJECT_CHUNK])
+                 if isinstance(idea, Idea)]
+        db.delete(ideas)
+        search.unindex_many(ideas)
+        rejected.extend(ideas)
+    return rejected
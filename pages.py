@@ -0,0 +1,152 @@
+"""Handlers for the informational pages, search and the live board.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+These pages are requested far less often than the listings, so this module is
+only imported when one of them is first requested, or when the instance is
+warmed up.
+"""
+import json
+import logging
+
+import webapp2
+
+import activity
+import cache
+import devices
+import leaderboard
+import search
+import settings
+from base import RequestHandler
+
+
+class SearchHandler(RequestHandler):
+    """Handler for searching ideas and projects."""
+    def get(self):
+        """Displays the ideas and projects matching the query."""
+        query = self.request.get('q')
+        try:
+            results = [{'kind': entity.kind(),
+                        'name': entity.name,
+                        'description': entity.description}
+                       for entity in search.search(query)]
+        except search.TooManyMatches as e:
+            return self.render('search', {'query': query,
+                                          'results': [],
+                                          'too_broad': e.term})
+        return self.render('search', {'query': query, 'results': results})
+
+
+class LiveHandler(RequestHandler):
+    """Handler for live feed requests."""
+    def get(self):
+        """Display the live feed."""
+        newest = activity.latest()
+
+        def data():
+            (events, through) = activity.since(0, newest)
+            events.reverse()
+            return {'events': events,
+                    'latest': through,
+                    'max_events': settings.ACTIVITY_SIZE,
+                    'poll_interval': settings.ACTIVITY_POLL_INTERVAL * 1000}
+
+        return self.render_page('live', data, newest)
+
+    def events(self):
+        """Returns the site activity newer than a given event as JSON.
+
+        The ETag is the sequence number the response brings the client up
+        to, so polls made when nothing has happened are answered with 304 Not
+        Modified.
+
+        Query Parameters:
+            after: the sequence number of the newest event the client has
+        """
+        try:
+            after = int(self.request.get('after', 0))
+        except ValueError:
+            return self.abort(400, 'after must be an event sequence number')
+        (events, through) = activity.since(after)
+        self.response.headers['Cache-Control'] = 'no-cache'
+        self.response.etag = str(through)
+        if str(through) in self.request.if_none_match:
+            self.response.status = 304
+            return
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json.dumps({
+            'events': events,
+            'latest': through,
+        }))
+
+
+class AboutHandler(RequestHandler):
+    """Handler for about requests."""
+    def get(self):
+        """Displays the about page."""
+        return self.render_page('about')
+
+
+class FAQHandler(RequestHandler):
+    """Handler for FAQ requests."""
+    def get(self):
+        """Displays the FAQ page."""
+        return self.render_page('faq')
+
+
+class TutHandler(RequestHandler):
+    """Handler for Tutorial requests."""
+    def get(self):
+        """Displays the Tutorial page."""
+        return self.render_page('tutorial')
+
+
+class EntryHandler(RequestHandler):
+    """Handler for Entry requests."""
+    def get(self):
+        """Displays the Results page."""
+        return self.render_page('entry')
+
+
+class ResultsHandler(RequestHandler):
+    """Handler for Results requests."""
+    def get(self):
+        """Displays the Results page."""
+        # the standings change with every vote, claim and new project
+        variant = '%s:%s' % (cache.generation('project'),
+                             cache.generation('group'))
+        return self.render_page(
+            'results', lambda: {'standings': leaderboard.standings()}, variant)
+
+    def standings(self):
+        """Returns the project standings as JSON."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json.dumps({
+            'standings': leaderboard.standings(),
+        }))
+
+
+class PaintHandler(webapp2.RequestHandler):
+    """Handler for the paint timings reported by a sample of page views."""
+    # names of the paint timings browsers report
+    TIMINGS = ('first-paint', 'first-contentful-paint')
+
+    def post(self):
+        """Logs how long a page took to paint, for the device it was on.
+
+        Form Variables:
+            device:                 mobile or desktop
+            first-paint:            milliseconds until the first paint
+            first-contentful-paint: milliseconds until content was painted
+        """
+        device = self.request.get('device')
+        if device not in (devices.MOBILE, devices.DESKTOP):
+            return self.abort(400)
+        timings = {'device': device}
+        for name in self.TIMINGS:
+            try:
+                timings[name] = int(self.request.get(name))
+            except ValueError:
+                pass
+        logging.info('paint stats: %s', json.dumps(timings, sort_keys=True))
+        self.response.status = 204
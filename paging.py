@@ -0,0 +1,127 @@
+"""Keyset pagination of datastore queries.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+Pages are addressed by bookmarks holding the sort value of the last entity of
+the previous page (or the first entity of the next one), so every page costs
+one query bounded by the page size no matter how far into the list it is.
+Results must be sorted on a property that is set on every entity and has few
+or no duplicate values, such as a timestamp or a unique name.
+"""
+import base64
+import datetime
+
+import settings
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class Page(object):
+    """One page of a query's results.
+
+    Attributes:
+    items: the entities on this page.
+    size:  the maximum number of entities on a page.
+    prev:  bookmark of the preceding page, or None if this is the first page.
+    next:  bookmark of the following page, or None if this is the last page.
+    """
+    def __init__(self, items, size, prev, next):
+        self.items = items
+        self.size = size
+        self.prev = prev
+        self.next = next
+
+
+def encode(value):
+    """Encodes a sort value as a URL safe bookmark."""
+    if isinstance(value, datetime.datetime):
+        raw = u'd' + value.strftime(DATETIME_FORMAT)
+    else:
+        raw = u's' + value
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii') \
+                 .rstrip('=')
+
+
+def decode(bookmark):
+    """Decodes a bookmark created by encode.
+
+    Raises: ValueError if the bookmark is malformed.
+    """
+    try:
+        padded = str(bookmark) + '=' * (-len(bookmark) % 4)
+        raw = base64.urlsafe_b64decode(padded).decode('utf-8')
+    except (TypeError, UnicodeError):
+        raise ValueError('malformed bookmark')
+    if raw.startswith(u'd'):
+        return datetime.datetime.strptime(raw[1:], DATETIME_FORMAT)
+    elif raw.startswith(u's'):
+        return raw[1:]
+    raise ValueError('malformed bookmark')
+
+
+def params(request):
+    """Reads the page size and bookmarks from a request.
+
+    Returns: a tuple of the form (size, after, before), where bookmarks that
+             are missing or malformed are None.
+    """
+    try:
+        size = int(request.get('size', settings.PAGE_SIZE))
+    except ValueError:
+        size = settings.PAGE_SIZE
+    size = max(1, min(size, settings.MAX_PAGE_SIZE))
+
+    bookmarks = []
+    for name in ('after', 'before'):
+        bookmark = request.get(name) or None
+        try:
+            if bookmark is not None:
+                decode(bookmark)
+        except ValueError:
+            bookmark = None
+        bookmarks.append(bookmark)
+    return (size, bookmarks[0], bookmarks[1])
+
+
+def fetch(model, order, size, after=None, before=None):
+    """Fetches one page of entities of a model.
+
+    Arguments:
+    model:  the model class to query.
+    order:  the property to sort on, prefixed with '-' for descending order.
+    size:   the maximum number of entities to return.
+    after:  bookmark of the entity the page starts after, or None.
+    before: bookmark of the entity the page ends before, or None. Ignored if
+            after is given.
+
+    Returns: a Page.
+    """
+    prop = order.lstrip('-')
+    descending = order.startswith('-')
+    backwards = after is None and before is not None
+
+    query = model.all()
+    if after is not None:
+        query.filter('%s %s' % (prop, '<' if descending else '>'),
+                     decode(after))
+    elif before is not None:
+        query.filter('%s %s' % (prop, '>' if descending else '<'),
+                     decode(before))
+    query.order(prop if descending == backwards else '-' + prop)
+
+    # one extra entity tells us whether there is anything past this page
+    items = query.fetch(size + 1)
+    more = len(items) > size
+    items = items[:size]
+    if backwards:
+        items.reverse()
+
+    if not items:
+        return Page(items, size, None, None)
+    first = encode(getattr(items[0], prop))
+    last = encode(getattr(items[-1], prop))
+    if backwards:
+        return Page(items, size, first if more else None, last)
+    else:
+        return Page(items, size, first if after else None,
+                    last if more else None)
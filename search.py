@@ -0,0 +1,202 @@
+"""Full text search over ideas and projects.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+Searching uses an inverted index of SearchPosting entities, one for each word
+of each indexed entity, keyed by the word followed by the entity's key.
+Since keys sort by word, the postings for every word starting with a prefix
+form a single key range, so a search only reads the postings that match it
+and never the ideas or projects themselves until the results are shown.
+"""
+import collections
+import re
+
+from google.appengine.ext import db
+
+from models import Idea, Project, SearchPosting
+
+# words that appear in almost everything and would only slow searches down
+STOP_WORDS = frozenset('a an and are as at be by for from has in is it its of '
+                       'on or that the this to was will with'.split())
+
+# how much more a word in the name counts than a word in the description
+NAME_WEIGHT = 3
+
+# searches only match words starting with at least this many characters
+MIN_PREFIX = 2
+
+# the most postings read for each word of a search, and how many are read at
+# a time. a word matching more is rejected as too broad
+MAX_POSTINGS = 5000
+POSTINGS_BATCH = 500
+
+# the models that are indexed. their name and description are searchable
+INDEXED = [Idea, Project]
+
+
+class TooManyMatches(Exception):
+    """Raised when a search term matches more than MAX_POSTINGS postings.
+
+    The term is available as term.
+    """
+    def __init__(self, term):
+        Exception.__init__(self, term)
+        self.term = term
+
+
+def tokenize(text):
+    """Returns the words of a text that are worth indexing, in lower case."""
+    words = re.findall(r'\w+', (text or u'').lower(), re.UNICODE)
+    return [word[:SearchPosting.MAX_WORD] for word in words
+            if word not in STOP_WORDS]
+
+
+def _weights(entity):
+    """Returns a dict of each word of an entity to its weight."""
+    weights = collections.defaultdict(int)
+    for word in tokenize(entity.name):
+        weights[word] += NAME_WEIGHT
+    for word in tokenize(entity.description):
+        weights[word] += 1
+    return weights
+
+
+def _postings(entity):
+    """Returns the postings of every indexed word of an entity."""
+    doc = str(entity.key())
+    return [SearchPosting(key=SearchPosting.key_for(word, doc),
+                          doc=doc,
+                          weight=weight)
+            for word, weight in _weights(entity).items()]
+
+
+def index(entity):
+    """Adds an idea or project to the index, replacing any old postings."""
+    unindex(entity.key())
+    db.put(_postings(entity))
+
+
+def index_many(entities):
+    """Adds new ideas or projects to the index with a single batch put.
+
+    Unlike index(), old postings aren't removed, so only use this for
+    entities that have never been indexed, or whose text hasn't changed.
+    """
+    postings = []
+    for entity in entities:
+        postings.extend(_postings(entity))
+    for i in range(0, len(postings), 500):
+        db.put(postings[i:i + 500])
+
+
+def unindex(key):
+    """Removes an entity from the index."""
+    while True:
+        keys = SearchPosting.all(keys_only=True).filter('doc =', str(key)) \
+                                               .fetch(500)
+        if not keys:
+            break
+        db.delete(keys)
+
+
+def unindex_many(entities):
+    """Removes ideas or projects from the index with a single batch delete.
+
+    The postings are worked out from the entities' text rather than queried,
+    so like index_many() this is only for entities whose text hasn't changed
+    since they were indexed.
+    """
+    keys = []
+    for entity in entities:
+        keys.extend(posting.key() for posting in _postings(entity))
+    for i in range(0, len(keys), 500):
+        db.delete(keys[i:i + 500])
+
+
+def _matches(term):
+    """Returns a dict of document keys to scores for one search term.
+
+    Every word starting with the term matches it, but exact matches score
+    twice as much. The postings are read POSTINGS_BATCH at a time.
+
+    Raises: TooManyMatches if the term matches more than MAX_POSTINGS
+            postings, rather than scoring only some of them.
+    """
+    start, end = SearchPosting.range_for(term)
+    query = SearchPosting.all().filter('__key__ >=', start) \
+                               .filter('__key__ <', end)
+    scores = {}
+    for i, posting in enumerate(query.run(batch_size=POSTINGS_BATCH,
+                                          limit=MAX_POSTINGS + 1)):
+        if i == MAX_POSTINGS:
+            raise TooManyMatches(term)
+        weight = posting.weight * (2 if posting.word == term else 1)
+        scores[posting.doc] = max(scores.get(posting.doc, 0), weight)
+    return scores
+
+
+def search(text, limit=50):
+    """Returns the ideas and projects matching every word of text.
+
+    Results are ordered by relevance, best first. The longest terms are
+    looked up first, since they match the fewest words, and the search stops
+    as soon as nothing matches.
+
+    Raises: TooManyMatches if a term matches too many words to score.
+    """
+    terms = sorted((term for term in set(tokenize(text))
+                    if len(term) >= MIN_PREFIX), key=len, reverse=True)
+    if not terms:
+        return []
+
+    scores = None
+    for term in terms:
+        matches = _matches(term)
+        if scores is None:
+            scores = matches
+        else:
+            scores = dict((doc, score + matches[doc])
+                          for doc, score in scores.items() if doc in matches)
+        if not scores:
+            return []
+
+    ranked = sorted(scores, key=lambda doc: -scores[doc])[:limit]
+    return [entity for entity in db.get([db.Key(doc) for doc in ranked])
+            if entity is not None]
+
+
+def rebuild():
+    """Rebuilds the index from every idea and project.
+
+    Every entity's postings are written first, replacing any with the same
+    key, and only then are the postings that no longer match the text of
+    their entity deleted. Searches keep working while this runs, and if it is
+    interrupted the index is no worse than before.
+    """
+    for model in INDEXED:
+        batch = []
+        for entity in model.all():
+            batch.append(entity)
+            if len(batch) == 100:
+                index_many(batch)
+                batch = []
+        index_many(batch)
+
+    query = SearchPosting.all(keys_only=True)
+    batch = []
+    for key in query.run(batch_size=POSTINGS_BATCH):
+        batch.append(key)
+        if len(batch) == POSTINGS_BATCH:
+            _delete_stale(batch)
+            batch = []
+    _delete_stale(batch)
+
+
+def _delete_stale(keys):
+    """Deletes the postings of words that aren't in their entity any more."""
+    postings = [key.name().split(SearchPosting.SEPARATOR, 1) for key in keys]
+    docs = list(set(doc for word, doc in postings))
+    words = dict((doc, _weights(entity) if entity is not None else {})
+                 for doc, entity in zip(docs, db.get(docs)))
+    db.delete([key for key, (word, doc) in zip(keys, postings)
+               if word not in words[doc]])
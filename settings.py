@@ -6,3 +6,71 @@ import os
 
 BASE_DIR = os.path.dirname(__file__)
 TEMPLATE_DIR = 'templates'
+STATIC_DIR = 'static'
+
+# number of counter shards each project's vote total is spread over. raising
+# this allows more concurrent votes per project but makes totals more costly
+# to read
+VOTE_COUNTER_SHARDS = 10
+
+# when True, votes are queued as they are cast and applied to the ledger in
+# batches by a background task, instead of being written immediately
+VOTE_WRITE_BEHIND = True
+
+# number of seconds between flushes of queued votes. the standings are
+# brought up to date by the flush, whether or not votes are queued
+VOTE_FLUSH_INTERVAL = 10
+
+# maximum number of values kept in each instance's in-process cache
+LOCAL_CACHE_SIZE = 200
+
+# number of items shown on each page of the listing pages, and the largest
+# page size that may be requested with the size parameter
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+# when True, every request is timed and its datastore RPCs are counted. the
+# results are logged and added to the response headers
+INSTRUMENTATION = True
+
+# queries repeated more than this many times in one request are logged as
+# likely N+1 query patterns
+N_PLUS_ONE_THRESHOLD = 5
+
+# number of recent events kept for the live activity feed, and the number of
+# seconds between the live board's checks for new ones
+ACTIVITY_SIZE = 100
+ACTIVITY_POLL_INTERVAL = 5
+
+# pages requested when a new instance is warmed up, so their listings are
+# already rendered and cached when the first visitor arrives
+WARMUP_PAGES = ['/projects', '/ideas', '/groups']
+
+# number of User-Agent strings whose device classification each instance
+# remembers
+DEVICE_CACHE_SIZE = 500
+
+# fraction of page views that report how long the page took to first paint
+PAINT_SAMPLE_RATE = 0.1
+
+# where data is stored: 'datastore' on App Engine, or 'sqlite' when running
+# the single-process development server in wsgi.py, which reads this setting.
+# see storage.py
+STORAGE = 'datastore'
+
+# the application ID and SQLite database used by the sqlite backend
+APPLICATION_ID = 'app-hackathon'
+SQLITE_PATH = 'hackathon.sqlite3'
+
+# outside App Engine, the signed in user is taken from this header, which
+# must be set by an authenticating proxy in front of the servers, and the
+# users listed in ADMINS are administrators
+TRUSTED_USER_HEADER = 'X-Forwarded-Email'
+ADMINS = []
+# the proxy's sign in and sign out pages, which the login and logout links
+# point at outside App Engine. %s is replaced by the page to return to
+LOGIN_URL = '/oauth2/start?rd=%s'
+LOGOUT_URL = '/oauth2/sign_out?rd=%s'
+
+# number of entities the statistics job processes in each task
+STATS_CHUNK = 100
@@ -0,0 +1,242 @@
+"""Event statistics for the admin dashboard, computed in the background.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+The job walks every submission, group, project and idea with query cursors,
+STATS_CHUNK entities per task. After each chunk it saves its place and its
+totals so far in the StatsJob entity and queues the next task in the same
+transaction, so a failed task is retried from where it left off and no chunk
+is counted twice. When the walk is done the totals are written to the
+StatsSnapshot entity, which the dashboard reads with a single get.
+
+Submissions are walked first and groups before projects, so that whether a
+group has submissions, and whether a project has been claimed, is known by
+the time the group or project is reached.
+
+Every refresh walks everything again rather than folding in only what has
+changed since the last one. Groups change their rosters and claims, votes
+change projects' totals and ideas are deleted when they are moderated, none
+of which leaves a trace a high-water mark could find, and a stale snapshot
+would be worse than a slow one. The refresh is incremental in that it runs a
+chunk at a time in the background while the dashboard keeps showing the
+previous snapshot.
+"""
+import datetime
+import json
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+
+import settings
+import votes
+from models import Group, Idea, Project, StatsJob, StatsSnapshot, Submission
+from models import run_in_xg_transaction
+
+STEP_URL = '/tasks/stats/step'
+
+KINDS = ['Submission', 'Group', 'Project', 'Idea']
+MODELS = {'Submission': Submission, 'Group': Group, 'Project': Project,
+          'Idea': Idea}
+
+# upper bounds of the vote count ranges projects are sorted into, and the
+# label of each range
+VOTE_BUCKETS = [(0, '0'), (4, '1-4'), (9, '5-9'), (24, '10-24'),
+                (None, '25+')]
+
+# names listed for groups without submissions and unclaimed projects
+MAX_NAMES = 50
+
+# a job that hasn't made progress for this long is assumed to have died
+STALE_AFTER = datetime.timedelta(minutes=10)
+
+
+def _empty():
+    """Returns the statistics of an event with nothing in it."""
+    return {
+        'groups': {'total': 0, 'public': 0, 'members': 0, 'pending': 0,
+                   'sizes': {}, 'without_project': 0,
+                   'without_submissions': 0,
+                   'without_submissions_names': []},
+        'projects': {'total': 0, 'claimed': 0, 'unclaimed': 0,
+                     'unclaimed_names': [], 'votes': 0,
+                     'vote_buckets': dict((label, 0)
+                                          for _, label in VOTE_BUCKETS)},
+        'ideas': {'total': 0, 'anonymous': 0},
+        'submissions': {'total': 0},
+        # keys of groups with submissions and of claimed projects, only kept
+        # while the job runs
+        'covered': [],
+        'claimed': [],
+    }
+
+
+def _bucket(count):
+    """Returns the label of the vote range a count falls in."""
+    for upper, label in VOTE_BUCKETS:
+        if upper is None or count <= upper:
+            return label
+
+
+def _add_submissions(totals, submissions):
+    """Adds a chunk of submissions to the totals."""
+    covered = set(totals['covered'])
+    for submission in submissions:
+        totals['submissions']['total'] += 1
+        covered.add(str(submission.group_key))
+    totals['covered'] = sorted(covered)
+
+
+def _add_groups(totals, groups):
+    """Adds a chunk of groups to the totals."""
+    covered = set(totals['covered'])
+    claimed = set(totals['claimed'])
+    stats = totals['groups']
+    for group in groups:
+        stats['total'] += 1
+        stats['public'] += 1 if group.public else 0
+        stats['members'] += len(group.members)
+        stats['pending'] += len(group.pending_users)
+        size = str(len(group.members))
+        stats['sizes'][size] = stats['sizes'].get(size, 0) + 1
+        project_key = Group.project.get_value_for_datastore(group)
+        if project_key is None:
+            stats['without_project'] += 1
+        else:
+            claimed.add(str(project_key))
+        if str(group.key()) not in covered:
+            stats['without_submissions'] += 1
+            if len(stats['without_submissions_names']) < MAX_NAMES:
+                stats['without_submissions_names'].append(group.name)
+    totals['claimed'] = sorted(claimed)
+
+
+def _add_projects(totals, projects):
+    """Adds a chunk of projects to the totals, with their vote counts."""
+    claimed = set(totals['claimed'])
+    stats = totals['projects']
+    counts = {}
+    # each project's total is spread over several shards, so the counts are
+    # fetched in smaller batches to keep each get under the datastore's limit
+    for i in range(0, len(projects), 50):
+        counts.update(votes.counts([project.key()
+                                    for project in projects[i:i + 50]]))
+    for project in projects:
+        stats['total'] += 1
+        if str(project.key()) in claimed:
+            stats['claimed'] += 1
+        else:
+            stats['unclaimed'] += 1
+            if len(stats['unclaimed_names']) < MAX_NAMES:
+                stats['unclaimed_names'].append(project.name)
+        count = counts[project.key()]
+        stats['votes'] += count
+        stats['vote_buckets'][_bucket(count)] += 1
+
+
+def _add_ideas(totals, ideas):
+    """Adds a chunk of ideas to the totals."""
+    for idea in ideas:
+        totals['ideas']['total'] += 1
+        totals['ideas']['anonymous'] += 1 if idea.author is None else 0
+
+
+AGGREGATORS = {'Submission': _add_submissions, 'Group': _add_groups,
+               'Project': _add_projects, 'Idea': _add_ideas}
+
+
+def _schedule(step):
+    """Queues the task processing the given step of the job."""
+    taskqueue.add(url=STEP_URL, params={'step': step}, transactional=True)
+
+
+def start():
+    """Starts computing the statistics, unless a job is already running.
+
+    Returns: True if a job was started.
+    """
+    def txn():
+        job = StatsJob.get_by_key_name(StatsJob.KEY_NAME)
+        now = datetime.datetime.utcnow()
+        if job is not None and now - job.updated < STALE_AFTER:
+            return False
+        job = StatsJob(key_name=StatsJob.KEY_NAME,
+                       kind=KINDS[0],
+                       partial=json.dumps(_empty()),
+                       step=0)
+        job.put()
+        _schedule(0)
+        return True
+
+    return db.run_in_transaction(txn)
+
+
+def step(number):
+    """Processes the next chunk of the walk.
+
+    Arguments:
+    number: the step the task was queued for. tasks for any other step are
+            left over from an earlier run or already done, and are ignored.
+    """
+    job = StatsJob.get_by_key_name(StatsJob.KEY_NAME)
+    if job is None or job.step != number:
+        return
+
+    query = MODELS[job.kind].all()
+    if job.cursor:
+        query.with_cursor(job.cursor)
+    batch = query.fetch(settings.STATS_CHUNK)
+    totals = json.loads(job.partial)
+    AGGREGATORS[job.kind](totals, batch)
+
+    if len(batch) == settings.STATS_CHUNK:
+        job.cursor = query.cursor()
+    elif job.kind != KINDS[-1]:
+        job.kind = KINDS[KINDS.index(job.kind) + 1]
+        job.cursor = None
+    else:
+        _finish(job, totals)
+        return
+
+    job.partial = json.dumps(totals)
+    job.step += 1
+
+    def txn():
+        current = StatsJob.get_by_key_name(StatsJob.KEY_NAME)
+        if current is None or current.step != number:
+            return
+        job.put()
+        _schedule(job.step)
+
+    db.run_in_transaction(txn)
+
+
+def _finish(job, totals):
+    """Stores the finished statistics and ends the job."""
+    del totals['covered']
+    del totals['claimed']
+    snapshot = StatsSnapshot(key_name=StatsSnapshot.KEY_NAME,
+                             stats=json.dumps(totals),
+                             started=job.started)
+
+    def txn():
+        current = StatsJob.get_by_key_name(StatsJob.KEY_NAME)
+        if current is None or current.step != job.step:
+            return
+        snapshot.put()
+        current.delete()
+
+    run_in_xg_transaction(txn)
+
+
+def current():
+    """Returns the latest statistics and the job computing new ones.
+
+    Both are fetched with a single batch get.
+
+    Returns: a tuple of the StatsSnapshot and the StatsJob, either of which
+             may be None.
+    """
+    return tuple(db.get([
+        db.Key.from_path(StatsSnapshot.kind(), StatsSnapshot.KEY_NAME),
+        db.Key.from_path(StatsJob.kind(), StatsJob.KEY_NAME),
+    ]))
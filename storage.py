@@ -0,0 +1,73 @@
+"""Storage and service backends for running the site.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+The models are written against the App Engine db API, which sends every
+operation through the API proxy to whichever service stub is registered for
+it. On App Engine that is the real datastore (the 'datastore' backend) and
+nothing needs to be set up. The 'sqlite' backend registers the SDK's SQLite
+datastore stub instead, along with in-process memcache, users and task queue
+stubs, so the same models and handlers can be run by the single-process
+development server in wsgi.py.
+
+The SQLite datastore keeps each kind in its own table, with entities indexed
+by key and by every indexed property, so gets and queries are indexed
+lookups. The stub runs every statement on one connection behind a lock, and
+memcache and the task queue live in the memory of the process, so a database
+must be served by a single process. That process may run as many threads as
+it likes, but the backend isn't meant for production traffic.
+"""
+import os
+
+import settings
+
+DATASTORE = 'datastore'
+SQLITE = 'sqlite'
+
+
+def _setup_sqlite(path):
+    """Registers the SQLite datastore and in-process service stubs."""
+    from google.appengine.api import apiproxy_stub_map
+    from google.appengine.api import user_service_stub
+    from google.appengine.api.memcache import memcache_stub
+    from google.appengine.api.taskqueue import taskqueue_stub
+    from google.appengine.datastore import datastore_sqlite_stub
+    from google.appengine.datastore import datastore_stub_util
+
+    os.environ.setdefault('APPLICATION_ID', settings.APPLICATION_ID)
+    os.environ.setdefault('AUTH_DOMAIN', 'gmail.com')
+    os.environ.setdefault('SERVER_SOFTWARE', 'Standalone/1.0')
+
+    # cross-group transactions need the high replication consistency model;
+    # probability=1 applies every write immediately
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+    datastore = datastore_sqlite_stub.DatastoreSqliteStub(
+        os.environ['APPLICATION_ID'], path, consistency_policy=policy,
+        root_path=settings.BASE_DIR)
+
+    apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+    apiproxy = apiproxy_stub_map.apiproxy
+    apiproxy.RegisterStub('datastore_v3', datastore)
+    apiproxy.RegisterStub('memcache', memcache_stub.MemcacheServiceStub())
+    apiproxy.RegisterStub('user', user_service_stub.UserServiceStub(
+        login_url=settings.LOGIN_URL, logout_url=settings.LOGOUT_URL))
+    apiproxy.RegisterStub('taskqueue', taskqueue_stub.TaskQueueServiceStub(
+        root_path=settings.BASE_DIR))
+
+
+def setup(backend=None):
+    """Prepares the given backend, or settings.STORAGE if none is given.
+
+    This must be called before main is imported.
+    """
+    backend = backend or settings.STORAGE
+    if backend == SQLITE:
+        _setup_sqlite(os.path.join(settings.BASE_DIR, settings.SQLITE_PATH))
+    elif backend == DATASTORE:
+        if not os.environ.get('SERVER_SOFTWARE', '').startswith(
+                ('Google App Engine', 'Development')):
+            raise ValueError("The datastore backend is only available on "
+                             "App Engine. Set settings.STORAGE to 'sqlite' "
+                             "to serve the site from wsgi.py")
+    else:
+        raise ValueError('Unknown storage backend %r' % backend)
@@ -0,0 +1,75 @@
+"""Template tags available to every template.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+The library is registered in base.py, so templates don't need to load it.
+"""
+# the copy of Django that webapp templates use, which needs no entry in the
+# libraries section of app.yaml
+from google.appengine._internal.django.utils.html import escape
+from google.appengine._internal.django.utils.safestring import mark_safe
+from google.appengine.ext.webapp import template
+
+import assets
+
+register = template.create_template_register()
+
+
+@register.simple_tag
+def asset(name):
+    """Renders the URL of a file in static/.
+
+    Usage:
+        <link rel="stylesheet" href="{% asset "main.css" %}">
+    """
+    return escape(assets.url(name))
+
+
+@register.simple_tag
+def critical_css(name):
+    """Renders the rules of a stylesheet needed for the first paint.
+
+    Usage:
+        <style>{% critical_css "main.css" %}</style>
+    """
+    # </ can't appear in a style element, and never does in a stylesheet
+    return mark_safe(assets.critical_css(name).replace('</', '<\\/'))
+
+
+def _srcset(variants):
+    """Returns a srcset attribute value listing the given variants."""
+    return ', '.join('%s %dw' % (variant['url'], variant['width'])
+                     for variant in variants)
+
+
+@register.simple_tag
+def responsive_img(name, alt, sizes='100vw', style=''):
+    """Renders an image from static/ using its resized derivatives.
+
+    Browsers that support WebP get the WebP derivatives, and every browser
+    picks the smallest derivative that fills the space given by sizes. If
+    tools/build_images.py hasn't generated derivatives for the image, the
+    original is used.
+
+    Usage:
+        {% responsive_img "group.JPG" "The group" "50vw" "float: left;" %}
+    """
+    attrs = 'alt="%s"' % escape(alt)
+    if style:
+        attrs += ' style="%s"' % escape(style)
+
+    entry = assets.image(name)
+    if entry is None:
+        return mark_safe('<img src="%s" %s>' % (escape(assets.url(name)),
+                                                attrs))
+
+    jpeg = entry['variants']['jpeg']
+    webp = entry['variants'].get('webp')
+    html = ['<picture>']
+    if webp:
+        html.append('<source type="image/webp" srcset="%s" sizes="%s">' %
+                    (_srcset(webp), escape(sizes)))
+    html.append('<img src="%s" srcset="%s" sizes="%s" %s>' %
+                (jpeg[-1]['url'], _srcset(jpeg), escape(sizes), attrs))
+    html.append('</picture>')
+    return mark_safe(''.join(html))
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+"""Benchmarks every route of the application against a local datastore.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+The application is run in-process on top of the App Engine SDK's testbed
+stubs, so no server or network is needed. The datastore is seeded with a
+configurable number of users, groups, projects, ideas, votes and
+submissions, then every route in main.application is requested repeatedly.
+For each route the latency percentiles, throughput and datastore RPCs per
+request (as reported by the instrumentation middleware) are printed and
+saved, and can be compared against a previous run:
+
+    $ python tools/bench.py --sdk ~/google_appengine --groups 2000 \\
+          --projects 2000 --output before.json
+    $ python tools/bench.py --sdk ~/google_appengine --groups 2000 \\
+          --projects 2000 --compare before.json
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import time
+
+import sdk
+
+BASE_DIR = sdk.BASE_DIR
+
+# (HTTP method, whether the route destroys the entity it is given) for routes
+# that don't simply display a page. destroyed entities are used only once
+ROUTES = {
+    'projects_delete': ('POST', True),
+    'projects_vote': ('POST', False),
+    'projects_claim': ('POST', False),
+    'ideas_approve': ('POST', True),
+    'ideas_delete': ('POST', True),
+    'ideas_moderate': ('POST', True),
+    'groups_create': ('POST', False),
+    'groups_delete': ('POST', True),
+    'groups_join': ('POST', False),
+    'groups_leave': ('POST', False),
+    'admin_stats_refresh': ('POST', False),
+    'tasks_stats_step': ('POST', False),
+    'tasks_add_projects': ('POST', False),
+    'stats_paint': ('POST', False),
+    'tasks_sync_memberships': ('POST', False),
+}
+
+
+def _stats_step_body(i, key):
+    """Returns the step of the statistics job, starting a job if none is."""
+    import stats
+
+    (snapshot, job) = stats.current()
+    if job is None:
+        stats.start()
+        (snapshot, job) = stats.current()
+    return 'step=%d' % job.step
+
+
+def _sync_body(i, key):
+    """Returns a membership sync of everyone on a group."""
+    from google.appengine.ext import db
+
+    import groups
+
+    user_ids = groups.snapshot(db.get(key))
+    return 'group=%s&users=%s' % (key, ','.join(user_ids))
+
+
+# bodies of POST routes that need more than a name, as a function of the
+# request number and the key of an entity, along with the kind of that entity
+# for routes that don't take a key in their URL
+BODIES = {
+    'ideas_moderate': (lambda i, key: 'action=approve&idea=%s' % key, 'Idea'),
+    'tasks_add_projects': (lambda i, key: 'project=%s' % key, 'Project'),
+    'stats_paint': (lambda i, key: 'device=%s&first-paint=%d'
+                    '&first-contentful-paint=%d' %
+                    (('mobile', 'desktop')[i % 2], 200 + i, 400 + i), None),
+    'tasks_sync_memberships': (_sync_body, 'Group'),
+    'tasks_stats_step': (_stats_step_body, None),
+}
+
+# models whose keys are substituted into the routes starting with each prefix
+KEY_KINDS = {'/projects/': 'Project', '/ideas/': 'Idea', '/groups/': 'Group'}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK'),
+                        help='path to the App Engine SDK')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--groups', type=int, default=100)
+    parser.add_argument('--members', type=int, default=4,
+                        help='members per group')
+    parser.add_argument('--projects', type=int, default=200)
+    parser.add_argument('--ideas', type=int, default=200)
+    parser.add_argument('--votes', type=int, default=5,
+                        help='votes cast by each user')
+    parser.add_argument('--submissions', type=int, default=2,
+                        help='submissions per group')
+    parser.add_argument('--requests', type=int, default=50,
+                        help='requests made to each route')
+    parser.add_argument('--routes', default=None,
+                        help='only benchmark routes matching this regex')
+    parser.add_argument('--cold', action='store_true',
+                        help='clear all caches before every request')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', default=None,
+                        help='results of a previous run to compare against')
+    return parser.parse_args()
+
+
+def setup_testbed():
+    """Activates stubs for every service the application uses."""
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    # fully consistent, so seeded data is visible to queries right away
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+    bed.init_datastore_v3_stub(consistency_policy=policy)
+    bed.init_memcache_stub()
+    bed.init_user_stub()
+    bed.init_taskqueue_stub(root_path=BASE_DIR)
+    bed.init_urlfetch_stub()
+    return bed
+
+
+def seed(args):
+    """Fills the datastore with test data and returns the seeded users."""
+    from google.appengine.api import users
+    from google.appengine.ext import db
+
+    import groups
+    import votes
+    from models import (Group, GroupName, Idea, Project, Submission, Vote,
+                        VoteCounterShard)
+
+    rand = random.Random(args.seed)
+    people = [users.User(email='user%d@example.com' % i,
+                         _user_id=str(100000 + i))
+              for i in range(args.users)]
+
+    def put_all(entities):
+        for i in range(0, len(entities), 500):
+            db.put(entities[i:i + 500])
+
+    put_all([Idea(name='Idea %d' % i,
+                  description='Description of idea %d. ' % i * 10,
+                  author=rand.choice(people))
+             for i in range(args.ideas)])
+    projects = [Project(name='Project %d' % i,
+                        description='Description of project %d. ' % i * 10,
+                        author=rand.choice(people))
+                for i in range(args.projects)]
+    put_all(projects)
+
+    ledger = []
+    totals = {}
+    for person in people:
+        for project in rand.sample(projects, min(args.votes, len(projects))):
+            ledger.append(Vote(key=Vote.key_for(project.key(),
+                                                person.user_id()),
+                               project=project,
+                               user=person))
+            totals[project.key()] = totals.get(project.key(), 0) + 1
+    put_all(ledger)
+    put_all([VoteCounterShard(key=votes.shard_keys(key)[0], project=key,
+                              count=count)
+             for key, count in totals.items()])
+
+    # people are split into groups of members, and the rest stay unattached
+    unattached = iter(people)
+    entities = []
+    for i in range(args.groups):
+        members = list(itertools.islice(unattached, args.members))
+        if not members:
+            break
+        group = Group(name='Group %d' % i,
+                      public=i % 2 == 0,
+                      owner=members[0],
+                      members=members,
+                      project=rand.choice(projects) if projects else None)
+        group.put()
+        entities.append(GroupName(key=GroupName.key_for(group.name),
+                                  group=group))
+        entities.extend(Submission(parent=group,
+                                   text='Submission %d' % j,
+                                   url='http://example.com/%d/%d' % (i, j),
+                                   group=group)
+                        for j in range(args.submissions))
+    put_all(entities)
+    groups.rebuild_memberships()
+    return people
+
+
+def login(bed, user, admin=False):
+    """Makes the given user the signed in user for following requests."""
+    bed.setup_env(USER_EMAIL=user.email() if user else '',
+                  USER_ID=user.user_id() if user else '',
+                  USER_IS_ADMIN='1' if admin else '0',
+                  overwrite=True)
+
+
+def targets(args):
+    """Returns a list of (name, method, url template, kind, destructive)."""
+    import main
+
+    result = []
+    for route in main.application.router.match_routes:
+        url = route.template
+        name = getattr(route, 'name', None) or url
+        if args.routes and not re.search(args.routes, name):
+            continue
+        method, destructive = ROUTES.get(name, ('GET', False))
+        kind = None
+        if '<key>' in url:
+            kind = [k for prefix, k in KEY_KINDS.items()
+                    if url.startswith(prefix)][0]
+        elif name in BODIES:
+            kind = BODIES[name][1]
+        result.append((name, method, url, kind, destructive))
+    return result
+
+
+def percentile(values, pct):
+    """Returns the nearest-rank percentile of a list of values."""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1,
+                      int(round(pct / 100.0 * len(values))) - 1))
+    return values[rank]
+
+
+def run_route(bed, args, people, target):
+    """Requests one route repeatedly and returns its measurements."""
+    import webapp2
+    from google.appengine.api import memcache
+    from google.appengine.ext import db
+
+    import cache
+    import main
+
+    name, method, template, kind, destructive = target
+    keys = []
+    if kind is not None:
+        keys = [str(key) for key in
+                db.Query(db.class_for_kind(kind), keys_only=True)
+                  .fetch(args.requests)]
+        if not keys:
+            return None
+    rand = random.Random(args.seed)
+
+    latencies = []
+    rpcs = []
+    statuses = {}
+    start = time.time()
+    for i in range(args.requests):
+        if destructive and i >= len(keys):
+            break
+        url = template
+        key = keys[i % len(keys)] if kind is not None else None
+        if kind is not None:
+            url = url.replace('<key>', key)
+        login(bed, rand.choice(people), admin=True)
+        if args.cold:
+            memcache.flush_all()
+            cache._local.clear()
+
+        request = webapp2.Request.blank(url, method=method)
+        if name in BODIES:
+            request.body = BODIES[name][0](i, key)
+        elif method == 'POST':
+            request.body = 'name=Bench%d' % i
+        began = time.time()
+        response = request.get_response(main.app)
+        latencies.append((time.time() - began) * 1000)
+        rpcs.append(int(response.headers.get('X-Stats-Datastore-Rpcs', 0)))
+        statuses[response.status_int] = statuses.get(response.status_int,
+                                                     0) + 1
+    elapsed = time.time() - start
+
+    return {'route': name,
+            'method': method,
+            'requests': len(latencies),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'throughput_rps': round(len(latencies) / elapsed, 1)
+                              if elapsed else 0,
+            'rpcs_mean': round(sum(rpcs) / float(len(rpcs)), 2)
+                         if rpcs else 0,
+            'rpcs_max': max(rpcs) if rpcs else 0,
+            'statuses': dict((str(k), v) for k, v in statuses.items())}
+
+
+def report(results, baseline):
+    """Prints a table of results, with changes from the baseline if given."""
+    previous = dict((r['route'], r) for r in baseline.get('routes', []))
+    print('%-20s %6s %9s %9s %9s %9s %8s' % (
+        'route', 'reqs', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'rpcs'))
+    for result in results:
+        print('%-20s %6d %9.2f %9.2f %9.2f %9.1f %8.2f' % (
+            result['route'][:20], result['requests'], result['p50_ms'],
+            result['p95_ms'], result['p99_ms'], result['throughput_rps'],
+            result['rpcs_mean']))
+        old = previous.get(result['route'])
+        if old:
+            print('%-20s %6s %+9.2f %+9.2f %+9.2f %+9.1f %+8.2f' % (
+                '  vs baseline', '', result['p50_ms'] - old['p50_ms'],
+                result['p95_ms'] - old['p95_ms'],
+                result['p99_ms'] - old['p99_ms'],
+                result['throughput_rps'] - old['throughput_rps'],
+                result['rpcs_mean'] - old['rpcs_mean']))
+
+
+def main():
+    args = parse_args()
+    sdk.setup(args.sdk)
+    bed = setup_testbed()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    began = time.time()
+    people = seed(args)
+    print('seeded in %.1fs' % (time.time() - began))
+
+    results = []
+    for target in targets(args):
+        result = run_route(bed, args, people, target)
+        if result is not None:
+            results.append(result)
+    report(results, baseline)
+
+    with open(args.output, 'w') as f:
+        json.dump({'config': dict((k, v) for k, v in vars(args).items()
+                                  if k not in ('sdk', 'compare', 'output')),
+                   'routes': results}, f, indent=1, sort_keys=True)
+        f.write('\n')
+    bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
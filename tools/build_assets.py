@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""Fingerprints the files in static/ so they can be cached forever.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+Every file in static/ (apart from the large photos, which are handled by
+build_images.py) is copied to static/build/ with a hash of its contents in
+its name, and text files also get a precompressed .gz copy for servers that
+can serve them directly. The manifest static/build/assets.json maps each
+original name to its fingerprinted URL, which the asset template tag looks
+up. Since a changed file gets a new name, app.yaml can tell browsers to keep
+everything under /static/build for a year.
+
+The rules each stylesheet applies to the header and navigation, which are
+the first things on every page, are also written to static/build/critical.json
+so pages can inline them and load the rest of the stylesheet without blocking
+the first paint.
+
+Run it from the project directory whenever a file in static/ changes, and
+commit the results:
+
+    $ python tools/build_assets.py
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+OUTPUT_DIR = os.path.join(STATIC_DIR, 'build')
+MANIFEST = os.path.join(OUTPUT_DIR, 'assets.json')
+CRITICAL_MANIFEST = os.path.join(OUTPUT_DIR, 'critical.json')
+
+# files larger than this are photos, which build_images.py takes care of
+MAX_SIZE = 1024 * 1024
+
+# extensions of files worth compressing
+COMPRESSIBLE = ('.css', '.js', '.svg', '.txt', '.html')
+
+# selectors of the rules styling the part of the page shown before anything
+# else: the page colours, header and navigation
+CRITICAL_SELECTORS = ('html, body', 'a', 'a:visited', '.pTtl', '#navBtn ul',
+                      '#navBtn ul li', '#navBtn ul a')
+
+
+def sources():
+    """Returns the names of the files in static/ to fingerprint."""
+    return sorted(name for name in os.listdir(STATIC_DIR)
+                  if os.path.isfile(os.path.join(STATIC_DIR, name)) and
+                  not name.startswith('.') and
+                  os.path.getsize(os.path.join(STATIC_DIR, name)) <= MAX_SIZE)
+
+
+def compress(data):
+    """Returns data gzipped, without a timestamp so the output is stable."""
+    out = io.BytesIO()
+    f = gzip.GzipFile(filename='', mode='wb', fileobj=out, mtime=0)
+    f.write(data)
+    f.close()
+    return out.getvalue()
+
+
+def fingerprint(name):
+    """Writes the fingerprinted copies of one file and returns its URL."""
+    path = os.path.join(STATIC_DIR, name)
+    with open(path, 'rb') as f:
+        data = f.read()
+    stem, ext = os.path.splitext(name)
+    filename = '%s.%s%s' % (stem, hashlib.sha1(data).hexdigest()[:10], ext)
+    shutil.copyfile(path, os.path.join(OUTPUT_DIR, filename))
+    if ext.lower() in COMPRESSIBLE:
+        with open(os.path.join(OUTPUT_DIR, filename + '.gz'), 'wb') as f:
+            f.write(compress(data))
+    return '/static/build/%s' % filename
+
+
+def critical(css):
+    """Returns the minified rules of a stylesheet in CRITICAL_SELECTORS."""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    rules = []
+    for selector, body in re.findall(r'([^{}]+)\{([^}]*)\}', css):
+        selector = ' '.join(selector.split())
+        if selector in CRITICAL_SELECTORS:
+            declarations = [' '.join(d.split()) for d in body.split(';')]
+            rules.append('%s{%s}' % (selector,
+                                     ';'.join(d for d in declarations if d)))
+    return ''.join(rules)
+
+
+def main():
+    if not os.path.isdir(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+
+    manifest = dict((name, fingerprint(name)) for name in sources())
+
+    # remove copies of older versions of the files
+    current = set(os.path.basename(url) for url in manifest.values())
+    current |= set(name + '.gz' for name in current)
+    for filename in os.listdir(OUTPUT_DIR):
+        path = os.path.join(OUTPUT_DIR, filename)
+        if (os.path.isfile(path) and not filename.endswith('.json') and
+                filename not in current):
+            os.remove(path)
+
+    with open(MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+    styles = {}
+    for name in sources():
+        if name.endswith('.css'):
+            with open(os.path.join(STATIC_DIR, name)) as f:
+                styles[name] = critical(f.read())
+    with open(CRITICAL_MANIFEST, 'w') as f:
+        json.dump(styles, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Generates resized derivatives of the photos in static/.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+The photos from the event are several megabytes each, which is far more than
+any screen needs. This script writes JPEG and WebP copies of each photo at a
+number of widths to static/build/img/, named after a hash of their contents
+so they can be cached forever, along with a manifest the responsive_img
+template tag uses to build srcset attributes.
+
+Requires the Python Imaging Library (Pillow). Run it from the project
+directory after adding or replacing a photo, and commit the results:
+
+    $ python tools/build_images.py
+"""
+import hashlib
+import io
+import json
+import os
+import sys
+
+try:
+    from PIL import Image
+except ImportError:
+    sys.exit('build_images.py requires the Python Imaging Library (Pillow)')
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+OUTPUT_DIR = os.path.join(STATIC_DIR, 'build', 'img')
+MANIFEST = os.path.join(STATIC_DIR, 'build', 'images.json')
+
+# widths to generate, in pixels. widths at or above the original's are skipped
+WIDTHS = [320, 640, 1024, 1600]
+
+# formats to generate, as (manifest name, PIL format, extension, options)
+FORMATS = [
+    ('jpeg', 'JPEG', 'jpg', {'quality': 80, 'optimize': True,
+                             'progressive': True}),
+    ('webp', 'WEBP', 'webp', {'quality': 75, 'method': 6}),
+]
+
+# images smaller than this are served as they are
+MIN_SIZE = 200 * 1024
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def photos():
+    """Returns the names of the images in static/ worth resizing."""
+    return sorted(name for name in os.listdir(STATIC_DIR)
+                  if name.lower().endswith(EXTENSIONS) and
+                  os.path.getsize(os.path.join(STATIC_DIR, name)) >= MIN_SIZE)
+
+
+def encode(image, fmt, options):
+    """Returns the bytes of an image saved in the given format."""
+    out = io.BytesIO()
+    image.save(out, fmt, **options)
+    return out.getvalue()
+
+
+def derive(name):
+    """Writes the derivatives of one image and returns its manifest entry."""
+    original = Image.open(os.path.join(STATIC_DIR, name))
+    original.load()
+    if original.mode not in ('RGB', 'L'):
+        original = original.convert('RGB')
+    width, height = original.size
+    stem = os.path.splitext(name)[0].lower()
+
+    entry = {'width': width, 'height': height, 'variants': {}}
+    for label, fmt, ext, options in FORMATS:
+        variants = []
+        for target in [w for w in WIDTHS if w < width] or [width]:
+            resized = original.resize(
+                (target, int(round(height * target / float(width)))),
+                Image.LANCZOS)
+            data = encode(resized, fmt, options)
+            digest = hashlib.sha1(data).hexdigest()[:10]
+            filename = '%s-%d.%s.%s' % (stem, target, digest, ext)
+            with open(os.path.join(OUTPUT_DIR, filename), 'wb') as f:
+                f.write(data)
+            variants.append({'width': target,
+                             'url': '/static/build/img/%s' % filename,
+                             'bytes': len(data)})
+        entry['variants'][label] = variants
+    return entry
+
+
+def main():
+    if not os.path.isdir(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+
+    manifest = {}
+    for name in photos():
+        manifest[name] = derive(name)
+        smallest = manifest[name]['variants']['jpeg'][0]['bytes']
+        print('%s: %d bytes -> %d bytes at %dpx' % (
+            name, os.path.getsize(os.path.join(STATIC_DIR, name)), smallest,
+            manifest[name]['variants']['jpeg'][0]['width']))
+
+    # remove derivatives of older versions of the photos
+    current = set(os.path.basename(variant['url'])
+                  for entry in manifest.values()
+                  for variants in entry['variants'].values()
+                  for variant in variants)
+    for filename in os.listdir(OUTPUT_DIR):
+        if filename not in current:
+            os.remove(os.path.join(OUTPUT_DIR, filename))
+
+    with open(MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Exports ideas, projects, groups and submissions to JSON lines or CSV.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+Data is read from a running instance of the app through remote_api in
+batches and written out as it arrives, so memory use stays flat however much
+data there is. With --state, the time of the newest entity exported of each
+kind is recorded, and the next run with the same state file only exports
+entities of that kind posted after it, which makes nightly incremental
+exports cheap:
+
+    $ python tools/export_data.py --sdk ~/google_appengine \\
+          --host app-hackathon.appspot.com --state nightly.json \\
+          --output ideas-$(date +%F).jsonl --kinds Idea,Project
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+
+import sdk
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK'),
+                        help='path to the App Engine SDK')
+    parser.add_argument('--host', default='localhost:8080',
+                        help='host name of the app to export from')
+    parser.add_argument('--kinds', default='',
+                        help='comma separated kinds to export')
+    parser.add_argument('--format', default='jsonl', choices=['jsonl', 'csv'])
+    parser.add_argument('--since', default=None,
+                        help='only export entities posted after this ISO 8601 '
+                             'timestamp')
+    parser.add_argument('--state', default=None,
+                        help='file remembering the last export, for '
+                             'incremental exports')
+    parser.add_argument('--output', default=None,
+                        help='file to write to instead of standard output')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sdk.setup(args.sdk)
+    sdk.connect(args.host)
+
+    import export
+
+    kinds = [kind for kind in args.kinds.split(',') if kind] or None
+
+    # the newest post time exported of each kind, as ISO 8601 timestamps
+    newest = {}
+    if args.state and os.path.exists(args.state):
+        with open(args.state) as f:
+            newest = json.load(f).get('newest') or {}
+        if not isinstance(newest, dict):
+            # older state files kept one time for every kind
+            newest = dict((kind, newest) for kind in export.KINDS)
+    if args.since:
+        newest.update((kind, args.since) for kind in kinds or export.KINDS)
+    since = dict((kind, export.parse_since(value))
+                 for kind, value in newest.items() if value)
+
+    writer = export.FORMATS[args.format][0]
+
+    def track(rows):
+        # remembers the newest post time of each kind on the way through
+        for row in rows:
+            (kind, posted) = (row['kind'], row.get('post_time'))
+            if posted and (newest.get(kind) is None or posted > newest[kind]):
+                newest[kind] = posted
+            yield row
+
+    out = open(args.output, 'wb') if args.output else sys.stdout
+    try:
+        for line in writer(track(export.rows(kinds, since))):
+            out.write(line)
+    finally:
+        if args.output:
+            out.close()
+
+    if args.state:
+        with open(args.state, 'w') as f:
+            json.dump({'newest': newest,
+                       'exported_at': datetime.datetime.utcnow().isoformat()},
+                      f)
+
+
+if __name__ == '__main__':
+    main()
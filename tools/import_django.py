@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""Imports ideas, projects and votes from the old Django site's database.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+Rows are streamed from the SQLite database a chunk at a time, so memory use
+doesn't depend on the size of the archive, and each chunk is written to the
+datastore with one batch put. Entities are keyed by their Django row ID, so
+importing the same rows twice overwrites them rather than duplicating them,
+and a checkpoint file records the last row imported from each table so an
+interrupted import can pick up where it stopped.
+
+The votes of the old site were only stored as a count per project, so they
+are added to each project's total without ledger entries.
+
+The app must be running with the remote_api builtin enabled:
+
+    $ python tools/import_django.py --sdk ~/google_appengine \\
+          --host localhost:8080 sqlite3.db
+"""
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+
+import sdk
+
+DATETIME_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S')
+
+# tables in the order they are imported. projects must come before votes
+TABLES = ('apps_idea', 'apps_project', 'apps_vote')
+
+QUERIES = {
+    'apps_idea': 'SELECT id, name, author, description, post_time '
+                 'FROM apps_idea WHERE id > ? ORDER BY id LIMIT ?',
+    'apps_project': 'SELECT id, name, description '
+                    'FROM apps_project WHERE id > ? ORDER BY id LIMIT ?',
+    'apps_vote': 'SELECT project_id, SUM(count) '
+                 'FROM apps_vote WHERE project_id > ? '
+                 'GROUP BY project_id ORDER BY project_id LIMIT ?',
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('database', help='the Django SQLite database')
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK'),
+                        help='path to the App Engine SDK')
+    parser.add_argument('--host', default='localhost:8080',
+                        help='host name of the app to import into')
+    parser.add_argument('--chunk', type=int, default=200,
+                        help='rows read and written at a time')
+    parser.add_argument('--checkpoint', default='import_checkpoint.json',
+                        help='file recording the progress of the import')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore the checkpoint and import everything')
+    return parser.parse_args()
+
+
+def key_name(row_id):
+    """Returns the key name of the entity imported from a Django row."""
+    return 'django-%d' % row_id
+
+
+def parse_datetime(value):
+    """Parses a datetime as stored by Django's SQLite backend."""
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def chunks(conn, table, last_id, size):
+    """Yields lists of rows from a table, starting after the given ID.
+
+    Every query is bounded, so only one chunk is held in memory at a time.
+    """
+    while True:
+        rows = conn.execute(QUERIES[table], (last_id, size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def authors(conn, names):
+    """Maps Django author names to App Engine users.
+
+    Ideas stored their author as a free text user name, which is looked up
+    in auth_user for an email address. Names that are already email
+    addresses are used as they are.
+    """
+    from google.appengine.api import users
+
+    emails = dict((name, name) for name in names if name and '@' in name)
+    lookup = [name for name in names if name and name not in emails]
+    if lookup:
+        query = ('SELECT username, email FROM auth_user WHERE username IN '
+                 '(%s)' % ','.join('?' * len(lookup)))
+        emails.update((username, email)
+                      for username, email in conn.execute(query, lookup)
+                      if email)
+    return dict((name, users.User(email=email))
+                for name, email in emails.items())
+
+
+def import_ideas(conn, rows):
+    from models import Idea
+
+    people = authors(conn, set(row[2] for row in rows))
+    return [Idea(key_name=key_name(row_id),
+                 name=name,
+                 author=people.get(author),
+                 description=description,
+                 post_time=parse_datetime(post_time))
+            for row_id, name, author, description, post_time in rows]
+
+
+def import_projects(conn, rows):
+    from models import Project
+
+    return [Project(key_name=key_name(row_id),
+                    name=name,
+                    description=description)
+            for row_id, name, description in rows]
+
+
+def import_votes(conn, rows):
+    from google.appengine.ext import db
+
+    import votes
+    from models import Project, VoteCounterShard
+
+    shards = []
+    for project_id, count in rows:
+        project_key = db.Key.from_path(Project.kind(), key_name(project_id))
+        shards.append(VoteCounterShard(
+            key=votes.imported_shard_key(project_key),
+            project=project_key,
+            count=count))
+    return shards
+
+
+IMPORTERS = {
+    'apps_idea': import_ideas,
+    'apps_project': import_projects,
+    'apps_vote': import_votes,
+}
+
+
+def main():
+    args = parse_args()
+    sdk.setup(args.sdk)
+    sdk.connect(args.host)
+
+    from google.appengine.ext import db
+
+    import cache
+    import leaderboard
+    import search
+
+    progress = dict((table, 0) for table in TABLES)
+    if os.path.exists(args.checkpoint) and not args.restart:
+        with open(args.checkpoint) as f:
+            progress.update(json.load(f))
+
+    conn = sqlite3.connect(args.database)
+    for table in TABLES:
+        imported = 0
+        for rows in chunks(conn, table, progress[table], args.chunk):
+            entities = IMPORTERS[table](conn, rows)
+            db.put(entities)
+            if table != 'apps_vote':
+                search.index_many(entities)
+            imported += len(rows)
+
+            progress[table] = rows[-1][0]
+            with open(args.checkpoint, 'w') as f:
+                json.dump(progress, f)
+        print('%s: imported %d rows' % (table, imported))
+    conn.close()
+
+    leaderboard.rebuild()
+    cache.bump('idea')
+    cache.bump('project')
+
+
+if __name__ == '__main__':
+    main()
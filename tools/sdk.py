@@ -0,0 +1,44 @@
+"""Helpers for running scripts in tools/ against the App Engine SDK.
+
+Author: Dan Albert <dan@gingerhq.net>
+"""
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup(path):
+    """Makes the SDK, its bundled libraries and the app importable.
+
+    Arguments:
+    path: the directory the App Engine SDK is installed in, or None to rely
+          on it already being on the Python path.
+    """
+    if path:
+        sys.path.insert(0, path)
+    try:
+        import dev_appserver
+    except ImportError:
+        sys.exit('The App Engine SDK was not found. Pass its path with --sdk.')
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, BASE_DIR)
+
+
+def connect(host):
+    """Points the datastore and other APIs at a running instance of the app.
+
+    The app must have the remote_api builtin enabled. The development server
+    accepts any credentials, and deployed apps are reached using the
+    application default credentials.
+    """
+    from google.appengine.ext.remote_api import remote_api_stub
+
+    if host.startswith('localhost') or host.startswith('127.0.0.1'):
+        remote_api_stub.ConfigureRemoteApi(
+            None, '/_ah/remote_api',
+            lambda: ('admin@example.com', ''),
+            servername=host,
+            secure=False)
+    else:
+        remote_api_stub.ConfigureRemoteApiForOAuth(host, '/_ah/remote_api')
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Measures how long a new instance of the application takes to start.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+Each run starts a fresh Python process on top of the App Engine SDK's
+testbed stubs, times importing main (what App Engine does before an
+instance's first request), then times the first request to a few pages. In
+the warm runs the /_ah/warmup request is made first, as App Engine does for
+new instances when warmup requests are enabled. The median of each
+measurement is printed and saved, and can be compared against a run made
+before a change:
+
+    $ python tools/startup.py --sdk ~/google_appengine --output before.json
+    $ python tools/startup.py --sdk ~/google_appengine --compare before.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import sdk
+
+# pages requested after startup, in order
+FIRST_PAGES = ['/projects', '/about', '/results']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK'),
+                        help='path to the App Engine SDK')
+    parser.add_argument('--runs', type=int, default=10,
+                        help='processes started for each mode')
+    parser.add_argument('--output', default='startup_results.json')
+    parser.add_argument('--compare', default=None,
+                        help='results of a previous run to compare against')
+    parser.add_argument('--child', choices=['cold', 'warm'],
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def measure(mode):
+    """Starts the app in this process and returns its timings in ms."""
+    import bench
+
+    bed = bench.setup_testbed()
+    timings = {}
+    began = time.time()
+    import main
+    timings['import'] = (time.time() - began) * 1000
+
+    import webapp2
+    if mode == 'warm':
+        began = time.time()
+        webapp2.Request.blank('/_ah/warmup').get_response(main.app)
+        timings['warmup'] = (time.time() - began) * 1000
+    for path in FIRST_PAGES:
+        began = time.time()
+        webapp2.Request.blank(path).get_response(main.app)
+        timings[path] = (time.time() - began) * 1000
+    bed.deactivate()
+    return timings
+
+
+def median(values):
+    """Returns the median of a list of numbers."""
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def run(args, mode):
+    """Measures startup in fresh processes and returns the median timings."""
+    command = [sys.executable, os.path.abspath(__file__), '--child', mode]
+    if args.sdk:
+        command += ['--sdk', args.sdk]
+    runs = []
+    for _ in range(args.runs):
+        runs.append(json.loads(subprocess.check_output(command)))
+    return dict((name, round(median([r[name] for r in runs]), 1))
+                for name in runs[0])
+
+
+def report(results, baseline):
+    """Prints the timings, with changes from the baseline if given."""
+    print('%-6s %-12s %10s %10s' % ('mode', 'step', 'median ms', 'change'))
+    for mode in ('cold', 'warm'):
+        previous = baseline.get(mode, {})
+        for name, value in sorted(results[mode].items()):
+            change = ''
+            if name in previous:
+                change = '%+.1f' % (value - previous[name])
+            print('%-6s %-12s %10.1f %10s' % (mode, name, value, change))
+
+
+def main():
+    args = parse_args()
+    sdk.setup(args.sdk)
+    if args.child:
+        print(json.dumps(measure(args.child)))
+        return
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    results = dict((mode, run(args, mode)) for mode in ('cold', 'warm'))
+    report(results, baseline)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+"""Vote ledger and sharded vote counters.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+Each vote is recorded as a Vote entity keyed by project and user, and each
+project's total is spread over several VoteCounterShard entities so that a
+popular project doesn't become a single entity that every voter writes to.
+
+When settings.VOTE_WRITE_BEHIND is enabled, votes are first stored as
+PendingVote entities and applied in batches by flush(), which a task runs
+every VOTE_FLUSH_INTERVAL seconds while votes are coming in.
+"""
+import collections
+import random
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+
+import settings
+from models import (PendingVote, Project, Vote, VoteCounterShard,
+                    run_in_xg_transaction)
+
+FLUSH_URL = '/tasks/votes/flush'
+
+# name of the shard holding votes imported from the old Django site, which
+# have no ledger entries. it is never picked for new votes, so re-running the
+# import can safely overwrite it
+IMPORTED_SHARD = 'imported'
+FLUSH_LOCK = 'votes:flush-lock'
+# voters whose queued votes for a project are applied in one transaction. it
+# spans the shard plus each voter's ledger entry and queue, and a transaction
+# may span at most 25 entity groups
+FLUSH_CHUNK = 12
+
+
+def shard_keys(project_key):
+    """Returns the keys of the counter shards new votes are added to."""
+    return [VoteCounterShard.key_for(project_key, shard)
+            for shard in range(settings.VOTE_COUNTER_SHARDS)]
+
+
+def imported_shard_key(project_key):
+    """Returns the key of the shard counting a project's imported votes."""
+    return VoteCounterShard.key_for(project_key, IMPORTED_SHARD)
+
+
+def has_voted(project_key, user):
+    """Returns True if the given user has voted for the project.
+
+    Votes the user has cast that haven't been flushed yet are taken into
+    account.
+    """
+    pending = _pending_votes(user)
+    if project_key in pending:
+        return pending[project_key]
+    return db.get(Vote.key_for(project_key, user.user_id())) is not None
+
+
+def cast(project_key, user):
+    """Toggles a user's vote for a project.
+
+    With write-behind enabled the vote is only queued, otherwise it is applied
+    immediately. Either way a flush is scheduled, which brings the standings
+    up to date. A vote applied immediately names its project in the flush,
+    since there is no queued vote for the flush to find it by.
+
+    Returns: True if the user's vote was added, False if it was removed.
+    """
+    if not settings.VOTE_WRITE_BEHIND:
+        voted = toggle(project_key, user)
+        schedule_flush(project_key)
+        return voted
+    voted = not has_voted(project_key, user)
+    PendingVote(parent=PendingVote.parent_for(user.user_id()),
+                project=project_key,
+                user=user,
+                voted=voted).put()
+    schedule_flush()
+    return voted
+
+
+def schedule_flush(project_key=None):
+    """Makes sure a flush will run at the end of the current interval.
+
+    Task names are derived from the interval, and the project if one is
+    given, so however many votes arrive in one interval only a single flush
+    is queued for it, or for each project voted on directly.
+
+    Arguments:
+    project_key: a project whose total changed without a queued vote, whose
+                 standing the flush should bring up to date.
+    """
+    interval = settings.VOTE_FLUSH_INTERVAL
+    now = time.time()
+    slot = int(now // interval)
+    name = 'flush-votes-%d' % slot
+    params = {}
+    if project_key is not None:
+        # string keys only use characters allowed in task names
+        name += '-%s' % project_key
+        params['project'] = str(project_key)
+    try:
+        taskqueue.add(name=name,
+                      url=FLUSH_URL,
+                      params=params,
+                      countdown=max(0, (slot + 1) * interval - now))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def toggle(project_key, user):
+    """Votes for a project, or removes the vote if the user already voted.
+
+    The ledger entry and the counter shard are updated in one transaction, so
+    the total always matches the number of votes in the ledger.
+
+    Returns: True if the user's vote was added, False if it was removed.
+    """
+    vote_key = Vote.key_for(project_key, user.user_id())
+    shard_key = random.choice(shard_keys(project_key))
+
+    def txn():
+        vote, shard = db.get([vote_key, shard_key])
+        if shard is None:
+            shard = VoteCounterShard(key=shard_key, project=project_key)
+        if vote is None:
+            shard.count += 1
+            db.put([Vote(key=vote_key, project=project_key, user=user),
+                    shard])
+            return True
+        else:
+            shard.count -= 1
+            shard.put()
+            vote.delete()
+            return False
+
+    return run_in_xg_transaction(txn)
+
+
+def counts(project_keys, user=None):
+    """Returns a dict mapping each of the given project keys to its total.
+
+    All of the shards are fetched with a single batch get. If a user is given,
+    their own unflushed votes are included so they see the effect of voting
+    right away.
+    """
+    keys = []
+    for project_key in project_keys:
+        keys.extend(shard_keys(project_key))
+        keys.append(imported_shard_key(project_key))
+    totals = dict((project_key, 0) for project_key in project_keys)
+    for shard in db.get(keys):
+        if shard is not None:
+            totals[VoteCounterShard.project.get_value_for_datastore(shard)] += \
+                shard.count
+    if user is not None:
+        include_pending(totals, user)
+    return totals
+
+
+def include_pending(totals, user):
+    """Adds a user's unflushed votes to a dict of totals from counts().
+
+    Totals can then be shared between users, and each user still sees the
+    effect of their own votes right away.
+    """
+    pending = [(key, voted) for key, voted in _pending_votes(user).items()
+               if key in totals]
+    ledger = db.get([Vote.key_for(key, user.user_id())
+                     for key, voted in pending])
+    for (project_key, voted), vote in zip(pending, ledger):
+        if voted and vote is None:
+            totals[project_key] += 1
+        elif not voted and vote is not None:
+            totals[project_key] -= 1
+    return totals
+
+
+def _pending_votes(user):
+    """Returns the user's unflushed votes as a dict of project key to vote.
+
+    Only the most recent pending vote for each project matters. The value is
+    True if the user's vote should be counted, False if it should be removed.
+    """
+    if not settings.VOTE_WRITE_BEHIND:
+        return {}
+    query = PendingVote.all().ancestor(PendingVote.parent_for(user.user_id()))
+    # sorted here rather than in the query to avoid needing a composite index
+    return dict((PendingVote.project.get_value_for_datastore(pending),
+                 pending.voted)
+                for pending in sorted(query, key=lambda p: p.post_time))
+
+
+def flush(limit=500):
+    """Applies up to limit queued votes to the ledger and counters.
+
+    Each project's queued votes are applied FLUSH_CHUNK voters at a time.
+    Every chunk is applied in its own transaction, which reads the voters'
+    ledger entries and queued votes again, adjusts one of the project's
+    shards by the net change, and deletes the queued votes it applied. A vote
+    is therefore counted exactly once, even if a flush fails partway or two
+    flushes overlap. The memcache lock only spares overlapping flushes the
+    wasted work.
+
+    Returns: a dict mapping the keys of projects whose totals changed to the
+             change in their total.
+    """
+    if not memcache.add(FLUSH_LOCK, 1, time=60):
+        return {}
+    try:
+        pending = PendingVote.all().order('post_time').fetch(limit)
+        queued = collections.defaultdict(
+            lambda: collections.defaultdict(list))
+        for vote in pending:
+            project_key = PendingVote.project.get_value_for_datastore(vote)
+            queued[project_key][vote.user.user_id()].append(vote.key())
+
+        deltas = collections.defaultdict(int)
+        for project_key, voters in queued.items():
+            user_ids = list(voters)
+            for i in xrange(0, len(user_ids), FLUSH_CHUNK):
+                chunk = dict((user_id, voters[user_id])
+                             for user_id in user_ids[i:i + FLUSH_CHUNK])
+                deltas[project_key] += run_in_xg_transaction(
+                    _apply_chunk, project_key, chunk)
+    finally:
+        memcache.delete(FLUSH_LOCK)
+
+    if len(pending) == limit:
+        schedule_flush()
+    return dict((key, delta) for key, delta in deltas.items() if delta)
+
+
+def _apply_chunk(project_key, queued):
+    """Applies some users' queued votes for a project in a transaction.
+
+    Queued votes that another flush has already applied and deleted are
+    skipped, and of the rest only each user's latest vote counts.
+
+    Arguments:
+    project_key: the key of the project voted on
+    queued: a dict of user ID to the keys of that user's queued votes
+
+    Returns: the change in the project's total.
+    """
+    user_ids = list(queued)
+    shard_key = random.choice(shard_keys(project_key))
+    vote_keys = [Vote.key_for(project_key, user_id) for user_id in user_ids]
+    queued_keys = [key for user_id in user_ids for key in queued[user_id]]
+    fetched = db.get([shard_key] + vote_keys + queued_keys)
+    shard = fetched[0] or VoteCounterShard(key=shard_key, project=project_key)
+    ledger = dict(zip(user_ids, fetched[1:len(vote_keys) + 1]))
+    applied = [vote for vote in fetched[len(vote_keys) + 1:]
+               if vote is not None]
+
+    latest = {}
+    for vote in sorted(applied, key=lambda vote: vote.post_time):
+        latest[vote.user.user_id()] = vote
+    delta = 0
+    puts = []
+    deletes = [vote.key() for vote in applied]
+    for user_id, vote in latest.items():
+        if vote.voted and ledger[user_id] is None:
+            puts.append(Vote(key=Vote.key_for(project_key, user_id),
+                             project=project_key,
+                             user=vote.user))
+            delta += 1
+        elif not vote.voted and ledger[user_id] is not None:
+            deletes.append(ledger[user_id].key())
+            delta -= 1
+    if delta:
+        shard.count += delta
+        puts.append(shard)
+    db.put(puts)
+    db.delete(deletes)
+    return delta
+
+
+def recount():
+    """Recomputes every project's vote total from the ledger.
+
+    Imported votes aren't in the ledger, so their shard is left alone.
+    """
+    for project_key in Project.all(keys_only=True):
+        total = Vote.all(keys_only=True).filter('project =', project_key) \
+                                        .count(limit=None)
+        shards = [VoteCounterShard(key=key, project=project_key, count=0)
+                  for key in shard_keys(project_key)]
+        shards[0].count = total
+        db.put(shards)
+
+
+def delete(project_key):
+    """Deletes the votes and counters belonging to a project."""
+    db.delete(shard_keys(project_key) + [imported_shard_key(project_key)])
+    while True:
+        keys = Vote.all(keys_only=True).filter('project =', project_key) \
+                                       .fetch(500)
+        if not keys:
+            break
+        db.delete(keys)
+
+
+def migrate_legacy():
+    """Moves votes stored in the old Project.votes list into the ledger."""
+    for project in Project.all():
+        if not project.legacy_votes:
+            continue
+        project_key = project.key()
+        shard_key = shard_keys(project_key)[0]
+        ledger = [Vote(key=Vote.key_for(project_key, user.user_id()),
+                       project=project_key,
+                       user=user)
+                  for user in project.legacy_votes]
+        existing = [vote for vote in db.get([v.key() for v in ledger]) if vote]
+        shard = db.get(shard_key) or VoteCounterShard(key=shard_key,
+                                                      project=project_key)
+        shard.count += len(ledger) - len(existing)
+        project.legacy_votes = []
+        db.put(ledger + [shard, project])
@@ -0,0 +1,212 @@
+"""Single-process development server for running the site outside App Engine.
+
+Author: Dan Albert <dan@gingerhq.net>
+
+The site runs on the services of the App Engine SDK, with data kept in
+SQLite when settings.STORAGE is 'sqlite' (see storage.py). The SDK must be
+importable, or its path given in the APPENGINE_SDK environment variable.
+This is meant for development and small private deployments, not production:
+the SDK's stubs keep the database on one connection and memcache and the task
+queue in memory, so everything must run in one process. Run it with
+
+    $ APPENGINE_SDK=~/google_appengine python wsgi.py 8080
+
+or point a threaded WSGI server at wsgi.app. Servers that run several worker
+processes aren't supported, and requests from them are refused; deploy to App
+Engine to serve the site at scale.
+
+Files under /static aren't served by the app; the front server should serve
+the static/ directory there, as app.yaml does on App Engine. Users sign in
+through an authenticating proxy, which must pass their email address in
+settings.TRUSTED_USER_HEADER and strip that header from incoming requests.
+The login and logout links lead to the proxy's settings.LOGIN_URL and
+settings.LOGOUT_URL.
+
+Queued tasks and the jobs in cron.yaml are run by a TaskRunner thread, which
+requests them from the app in this process.
+"""
+import base64
+import hashlib
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+if os.environ.get('APPENGINE_SDK'):
+    sys.path.insert(0, os.environ['APPENGINE_SDK'])
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+import settings
+import storage
+
+# the stubs must be registered before anything using them is imported
+storage.setup()
+
+import webob
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import croninfo
+from google.appengine.runtime import request_environment
+
+import main
+
+# URL prefixes that app.yaml restricts to administrators
+ADMIN_ONLY = ('/admin/', '/tasks/', '/_ah/warmup')
+# marks the requests made by the TaskRunner. unlike a header, a client can't
+# set it
+TASK_REQUEST = 'hackathon.task_request'
+# seconds between checks for due tasks, and before a failed task is retried
+TASK_POLL_INTERVAL = 1
+TASK_RETRY_DELAY = 30
+# cron.yaml schedules the TaskRunner understands, in seconds per unit
+CRON_UNITS = {'minutes': 60, 'hours': 60 * 60}
+
+
+def _user_id(email):
+    """Returns a stable numeric user ID for an email address."""
+    return str(int(hashlib.md5(email.lower()).hexdigest()[:15], 16))
+
+
+class Environment(object):
+    """WSGI middleware that sets up each request the way App Engine does.
+
+    The App Engine APIs read the details of the request, including who is
+    signed in, from os.environ. It is made thread-local, and every request
+    gets the process environment plus its own CGI variables and user. Servers
+    that say they run several processes are refused, since each would have
+    its own memcache and task queue.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.base = dict(os.environ)
+        self.header = 'HTTP_' + settings.TRUSTED_USER_HEADER.upper() \
+                                                            .replace('-', '_')
+        request_environment.PatchOsEnviron()
+
+    def __call__(self, environ, start_response):
+        if environ.get('wsgi.multiprocess'):
+            start_response('500 Internal Server Error',
+                           [('Content-Type', 'text/plain')])
+            return ['wsgi.py must be served by a single process.\n']
+        email = environ.get(self.header, '')
+        admin = email in settings.ADMINS or TASK_REQUEST in environ
+        if environ.get('PATH_INFO', '').startswith(ADMIN_ONLY) and not admin:
+            start_response('403 Forbidden', [('Content-Type', 'text/plain')])
+            return ['Only administrators may do that.\n']
+
+        request = dict(self.base)
+        request.update((name, value) for name, value in environ.items()
+                       if isinstance(value, str))
+        request['USER_EMAIL'] = email
+        request['USER_ID'] = _user_id(email) if email else ''
+        request['USER_IS_ADMIN'] = '1' if admin else '0'
+        request_environment.current_request.Init(environ.get('wsgi.errors'),
+                                                 request)
+        try:
+            body = self.app(environ, start_response)
+        except Exception:
+            request_environment.current_request.Clear()
+            raise
+        return self.stream(body)
+
+    def stream(self, body):
+        """Yields a response body, keeping the request set up until it ends.
+
+        Bodies such as exports are generators that use the App Engine APIs
+        while the server sends them, after the app has returned.
+        """
+        try:
+            for chunk in body:
+                yield chunk
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+            request_environment.current_request.Clear()
+
+
+class TaskRunner(threading.Thread):
+    """Runs queued tasks and cron jobs by requesting them from the app.
+
+    On App Engine the task queue and cron send requests to the app. Here the
+    queue is the in-process stub, so this thread checks it every
+    TASK_POLL_INTERVAL seconds and requests each task that is due as an
+    administrator, deleting it once it succeeds. A task that fails is tried
+    again after TASK_RETRY_DELAY seconds. The jobs in cron.yaml with a
+    schedule of the form 'every N minutes' or 'every N hours' are requested
+    the same way.
+    """
+    def __init__(self, app, queue='default'):
+        threading.Thread.__init__(self, name='TaskRunner')
+        self.daemon = True
+        self.app = app
+        self.queue = queue
+        self.stub = apiproxy_stub_map.apiproxy.GetStub('taskqueue')
+        self.retry_at = {}
+        self.cron = []
+        with open(os.path.join(settings.BASE_DIR, 'cron.yaml')) as f:
+            for job in croninfo.LoadSingleCron(f).cron:
+                match = re.match(r'every (\d+) (minutes|hours)$', job.schedule)
+                if match:
+                    interval = int(match.group(1)) * CRON_UNITS[match.group(2)]
+                    self.cron.append([job.url, interval, time.time()])
+                else:
+                    logging.warning('Not running %s on schedule %r',
+                                    job.url, job.schedule)
+
+    def request(self, method, url, headers=(), body=''):
+        """Sends a request to the app and returns whether it succeeded."""
+        request = webob.Request.blank(url, environ={'REQUEST_METHOD': method,
+                                                    TASK_REQUEST: True},
+                                      headers=list(headers))
+        request.body = body
+        response = request.get_response(self.app)
+        if response.status_int >= 300:
+            logging.warning('%s %s failed with %s', method, url,
+                            response.status)
+        return response.status_int < 300
+
+    def run_due(self):
+        """Runs every cron job and task that is due."""
+        now = time.time()
+        for job in self.cron:
+            (url, interval, last) = job
+            if now - last >= interval:
+                job[2] = now
+                self.request('GET', url)
+        for task in self.stub.GetTasks(self.queue):
+            name = task['name']
+            if (task['eta_usec'] > now * 1e6 or
+                    self.retry_at.get(name, 0) > now):
+                continue
+            if self.request(task['method'], task['url'], task['headers'],
+                            base64.b64decode(task['body'])):
+                self.stub.DeleteTask(self.queue, name)
+                self.retry_at.pop(name, None)
+            else:
+                self.retry_at[name] = time.time() + TASK_RETRY_DELAY
+
+    def run(self):
+        while True:
+            try:
+                self.run_due()
+            except Exception:
+                logging.exception('Running tasks failed')
+            time.sleep(TASK_POLL_INTERVAL)
+
+
+app = Environment(main.app)
+TaskRunner(app).start()
+
+
+if __name__ == '__main__':
+    from SocketServer import ThreadingMixIn
+    from wsgiref.simple_server import WSGIServer, make_server
+
+    class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    make_server('', port, app,
+                server_class=ThreadingWSGIServer).serve_forever()